@@ -157,32 +157,50 @@ page. It is not a recursive crawler.
 
 import optparse
 import os
+import socket
 import sys
 import re
+import threading
+
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
 
 try:
     # Try importing for Python 3
     # pylint: disable-msg=F0401
     # pylint: disable-msg=E0611
-    from urllib.request import HTTPCookieProcessor, Request, build_opener
+    from urllib.request import HTTPCookieProcessor, HTTPHandler, HTTPSHandler, Request, build_opener
+    from urllib.response import addinfourl
+    from urllib.error import URLError
     from urllib.parse import quote, unquote
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
     from http.cookiejar import MozillaCookieJar
 except ImportError:
     # Fallback for Python 2
-    from urllib2 import Request, build_opener, HTTPCookieProcessor
-    from urllib import quote, unquote
+    from urllib2 import Request, build_opener, HTTPCookieProcessor, HTTPHandler, HTTPSHandler, URLError
+    from urllib import addinfourl, quote, unquote
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
     from cookielib import MozillaCookieJar
 
 # Import BeautifulSoup -- try 4 first, fall back to older
 try:
-    from bs4 import BeautifulSoup
+    from bs4 import BeautifulSoup, SoupStrainer
 except ImportError:
     try:
         from BeautifulSoup import BeautifulSoup
+        SoupStrainer = None
     except ImportError:
         print('We need BeautifulSoup, sorry...')
         sys.exit(1)
 
+# With BeautifulSoup 4, use the lxml tree builder if available, as it is
+# much faster than Python's built-in HTML parser.
+if SoupStrainer is None:
+    HTML_PARSER = None
+else:
+    from bs4.builder import builder_registry
+    HTML_PARSER = 'lxml' if builder_registry.lookup('lxml') else 'html.parser'
+
 # Support unicode in both Python 2 and 3. In Python 3, unicode is str.
 if sys.version_info[0] == 3:
     unicode = str # pylint: disable-msg=W0622
@@ -223,6 +241,25 @@ class ScholarConf(object):
     # cookie use across sessions.
     COOKIE_JAR_FILE = None
 
+    # If set, an object with an acquire() method (e.g., a token bucket)
+    # that is called before each HTTP request, and blocks as needed to
+    # limit the rate of requests sent to Scholar.
+    RATE_LIMITER = None
+
+    # If set, a cache of HTTP responses with get_ttl(url), get(url), and
+    # put(url, data) methods. Cached responses are returned without sending requests,
+    # and settings are only applied once a response is not cached.
+    RESPONSE_CACHE = None
+
+    # Number of threads retrieving the citation export data of the
+    # articles of a results page concurrently.
+    CITATION_WORKERS = 1
+
+    # If set, the base URL of a site (e.g., 'http://127.0.0.1:8000')
+    # to which requests to SCHOLAR_SITE are sent instead, such as a
+    # local stand-in server (see tools/standin.py).
+    SITE_OVERRIDE = None
+
 class ScholarUtils(object):
     """A wrapper for various utensils that come in handy."""
 
@@ -247,6 +284,47 @@ class ScholarUtils(object):
         sys.stderr.write('[%5s]  %s' % (level.upper(), msg + '\n'))
         sys.stderr.flush()
 
+    @staticmethod
+    def get_site_url(url):
+        """
+        Returns the URL to request for a Scholar URL, i.e., the URL on
+        ScholarConf.SITE_OVERRIDE if set (over HTTP or HTTPS).
+        """
+        if ScholarConf.SITE_OVERRIDE is None:
+            return url
+        host = ScholarConf.SCHOLAR_SITE.split('://', 1)[-1]
+        for prefix in ('http://' + host, 'https://' + host):
+            if url.startswith(prefix):
+                return ScholarConf.SITE_OVERRIDE.rstrip('/') + url[len(prefix):]
+        return url
+
+    @staticmethod
+    def make_soup(html, result_class=None):
+        """
+        Parses HTML content into a BeautifulSoup tree. If result_class
+        is given, only the result blocks (div elements with that class)
+        and the results count are parsed, skipping the rest of the page
+        (scripts, styles, menus, etc.), which saves most of the parsing
+        time. BeautifulSoup 3 always parses the whole page.
+        """
+        if SoupStrainer is None:
+            return BeautifulSoup(html)
+        if result_class is None:
+            return BeautifulSoup(html, HTML_PARSER)
+
+        def _is_result_block(name, attrs):
+            if name != 'div':
+                return False
+            if attrs.get('id') == 'gs_ab_md':
+                return True
+            klass = attrs.get('class') or []
+            if type(klass) != list:
+                klass = klass.split()
+            return result_class in klass
+
+        return BeautifulSoup(html, HTML_PARSER,
+                             parse_only=SoupStrainer(_is_result_block))
+
 
 class ScholarArticle(object):
     """
@@ -359,7 +437,8 @@ class ScholarArticleParser(object):
         content as needed, and notifies the parser instance of
         resulting instances via the handle_article callback.
         """
-        self.soup = BeautifulSoup(html)
+        # Only the result blocks and the results count are parsed.
+        self.soup = ScholarUtils.make_soup(html, 'gs_r')
 
         # This parses any global, non-itemized attributes from the page.
         self._parse_globals()
@@ -453,6 +532,14 @@ class ScholarArticleParser(object):
                 self.article['url_versions'] = \
                     self._strip_url_arg('num', self._path2url(tag.get('href')))
 
+                # Articles without citations only provide their cluster
+                # ID in the versions URL.
+                if self.article['cluster_id'] is None:
+                    args = self.article['url_versions'].split('?', 1)[1]
+                    for arg in args.split('&'):
+                        if arg.startswith('cluster='):
+                            self.article['cluster_id'] = arg[8:]
+
             if tag.getText().startswith('Import'):
                 self.article['url_citation'] = self._path2url(tag.get('href'))
 
@@ -470,6 +557,23 @@ class ScholarArticleParser(object):
             res = res.split()
         return klass in res
 
+    @staticmethod
+    def _find_divs(tag):
+        """
+        Finds the first div descendant of a tag with each class, in a
+        single pass over the tag (a find() per class walks it again).
+        Returns a dict mapping classes to tags.
+        """
+        divs = {}
+        for div in tag.findAll('div'):
+            res = div.get('class') or []
+            if type(res) != list:
+                res = res.split()
+            for klass in res:
+                if klass not in divs:
+                    divs[klass] = div
+        return divs
+
     @staticmethod
     def _tag_results_checker(tag):
         return tag.name == 'div' \
@@ -537,11 +641,11 @@ class ScholarArticleParser120726(ScholarArticleParser):
         self.article = ScholarArticle()
 
         for tag in div:
-            if not hasattr(tag, 'name'):
+            if getattr(tag, 'name', None) is None:
                 continue
-            if str(tag).lower().find('.pdf'):
-                if tag.find('div', {'class': 'gs_ttss'}):
-                    self._parse_links(tag.find('div', {'class': 'gs_ttss'}))
+            divs = self._find_divs(tag)
+            if 'gs_ttss' in divs:
+                self._parse_links(divs['gs_ttss'])
 
             if tag.name == 'div' and self._tag_has_class(tag, 'gs_ri'):
                 # There are (at least) two formats here. In the first
@@ -578,16 +682,16 @@ class ScholarArticleParser120726(ScholarArticleParser):
                         span.clear()
                     self.article['title'] = ''.join(tag.h3.findAll(text=True))
 
-                if tag.find('div', {'class': 'gs_a'}):
-                    year = self.year_re.findall(tag.find('div', {'class': 'gs_a'}).text)
+                if 'gs_a' in divs:
+                    year = self.year_re.findall(divs['gs_a'].text)
                     self.article['year'] = year[0] if len(year) > 0 else None
 
-                if tag.find('div', {'class': 'gs_fl'}):
-                    self._parse_links(tag.find('div', {'class': 'gs_fl'}))
+                if 'gs_fl' in divs:
+                    self._parse_links(divs['gs_fl'])
 
-                if tag.find('div', {'class': 'gs_rs'}):
+                if 'gs_rs' in divs:
                     # These are the content excerpts rendered into the results.
-                    raw_text = tag.find('div', {'class': 'gs_rs'}).findAll(text=True)
+                    raw_text = divs['gs_rs'].findAll(text=True)
                     if len(raw_text) > 0:
                         raw_text = ''.join(raw_text)
                         raw_text = raw_text.replace('\n', '')
@@ -864,6 +968,145 @@ class ScholarSettings(object):
     def is_configured(self):
         return self._is_configured
 
+    def __eq__(self, other):
+        return isinstance(other, ScholarSettings) \
+            and self.citform == other.citform \
+            and self.per_page_results == other.per_page_results
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+class KeepAliveMixin(object):
+    """
+    Mixin for urllib handlers that keeps the connections to each host
+    open and reuses them across requests (and threads), instead of
+    opening a new connection per request. Response bodies are read
+    completely, so that connections can be returned to the pool.
+    """
+    def _init_pool(self):
+        self._pool = {}
+        self._pool_lock = threading.Lock()
+
+    def _get_connection(self, connection_class, host, tunnel_host, tunnel_headers, timeout):
+        # connections through a proxy are pooled by proxy and tunneled host
+        with self._pool_lock:
+            idle = self._pool.get((host, tunnel_host))
+            if idle:
+                return idle.pop(), True
+        conn = connection_class(host, timeout=timeout)
+        if tunnel_host:
+            conn.set_tunnel(tunnel_host, headers=tunnel_headers)
+        return conn, False
+
+    def _release_connection(self, host, tunnel_host, conn):
+        with self._pool_lock:
+            self._pool.setdefault((host, tunnel_host), []).append(conn)
+
+    def close_connections(self):
+        """Closes all idle connections."""
+        with self._pool_lock:
+            for connections in self._pool.values():
+                for conn in connections:
+                    conn.close()
+            self._pool = {}
+
+    def _keep_alive_open(self, connection_class, req):
+        host = req.host if hasattr(req, 'host') and req.host else req.get_host()
+        selector = req.selector if hasattr(req, 'selector') else req.get_selector()
+        headers = dict(req.unredirected_hdrs)
+        headers.update((k, v) for k, v in req.headers.items() if k not in headers)
+        headers['Connection'] = 'keep-alive'
+        timeout = getattr(req, 'timeout', socket._GLOBAL_DEFAULT_TIMEOUT)
+
+        # HTTPS requests through a proxy (see ProxyHandler) are sent to
+        # the proxy, which tunnels them to the host (as in do_open() of
+        # AbstractHTTPHandler)
+        tunnel_host = getattr(req, '_tunnel_host', None)
+        tunnel_headers = {}
+        headers = dict((name.title(), value) for name, value in headers.items())
+        if tunnel_host and 'Proxy-Authorization' in headers:
+            # the proxy credentials are not sent to the host
+            tunnel_headers['Proxy-Authorization'] = headers.pop('Proxy-Authorization')
+
+        while True:
+            conn, reused = self._get_connection(connection_class, host, tunnel_host, tunnel_headers, timeout)
+            try:
+                conn.request(req.get_method(), selector, req.data, headers)
+                resp = conn.getresponse()
+                data = resp.read()
+                break
+            except (socket.error, HTTPException) as err:
+                conn.close()
+                # an idle connection may have been closed by the server
+                # in the meantime, thus the request is retried once on
+                # a new connection
+                if not reused:
+                    raise URLError(err)
+
+        if resp.will_close:
+            conn.close()
+        else:
+            self._release_connection(host, tunnel_host, conn)
+
+        response = addinfourl(BytesIO(data), resp.msg, req.get_full_url())
+        response.code = resp.status
+        response.msg = resp.reason
+        return response
+
+
+class KeepAliveHTTPHandler(KeepAliveMixin, HTTPHandler):
+    def __init__(self, debuglevel=0):
+        HTTPHandler.__init__(self, debuglevel)
+        self._init_pool()
+
+    def http_open(self, req):
+        return self._keep_alive_open(HTTPConnection, req)
+
+
+class KeepAliveHTTPSHandler(KeepAliveMixin, HTTPSHandler):
+    def __init__(self, debuglevel=0):
+        HTTPSHandler.__init__(self, debuglevel)
+        self._init_pool()
+
+    def https_open(self, req):
+        return self._keep_alive_open(HTTPSConnection, req)
+
+
+class ScholarSession(object):
+    """
+    A ScholarSession holds the state shared by any number of
+    ScholarQuerier instances (possibly used by different threads):
+    the cookie jar, a pool of keep-alive connections, and the last
+    settings applied, so that settings are only applied once.
+    """
+    def __init__(self):
+        self.cjar = MozillaCookieJar()
+
+        # If we have a cookie file, load it:
+        if ScholarConf.COOKIE_JAR_FILE and \
+           os.path.exists(ScholarConf.COOKIE_JAR_FILE):
+            try:
+                self.cjar.load(ScholarConf.COOKIE_JAR_FILE,
+                               ignore_discard=True)
+                ScholarUtils.log('info', 'loaded cookies file')
+            except Exception as msg:
+                ScholarUtils.log('warn', 'could not load cookies file: %s' % msg)
+                self.cjar = MozillaCookieJar() # Just to be safe
+
+        self.http_handler = KeepAliveHTTPHandler()
+        self.https_handler = KeepAliveHTTPSHandler()
+        self.opener = build_opener(self.http_handler, self.https_handler,
+                                   HTTPCookieProcessor(self.cjar))
+        self.settings = None # Last settings object applied, if any
+        self.pending_settings = None # Settings to apply before the next request, if any
+        self.settings_lock = threading.Lock()
+
+    def close(self):
+        """Closes the idle connections of the session."""
+        self.http_handler.close_connections()
+        self.https_handler.close_connections()
+
 
 class ScholarQuerier(object):
 
@@ -904,32 +1147,54 @@ class ScholarQuerier(object):
         def handle_article(self, art):
             self.querier.add_article(art)
 
-    def __init__(self):
+    def __init__(self, session=None):
         self.articles = []
         self.query = None
-        self.cjar = MozillaCookieJar()
 
-        # If we have a cookie file, load it:
-        if ScholarConf.COOKIE_JAR_FILE and \
-           os.path.exists(ScholarConf.COOKIE_JAR_FILE):
-            try:
-                self.cjar.load(ScholarConf.COOKIE_JAR_FILE,
-                               ignore_discard=True)
-                ScholarUtils.log('info', 'loaded cookies file')
-            except Exception as msg:
-                ScholarUtils.log('warn', 'could not load cookies file: %s' % msg)
-                self.cjar = MozillaCookieJar() # Just to be safe
-
-        self.opener = build_opener(HTTPCookieProcessor(self.cjar))
+        # Queriers sharing a session share its cookies, connections,
+        # and applied settings
+        self.session = session or ScholarSession()
+        self.cjar = self.session.cjar
+        self.opener = self.session.opener
         self.settings = None # Last settings object, if any
 
+        # If set, a function that receives an article and tells whether
+        # its citation export data should be retrieved
+        self.citation_filter = None
+
     def apply_settings(self, settings):
         """
         Applies settings as provided by a ScholarSettings instance.
+        Settings equal to those already applied in the session are not
+        applied again.
         """
         if settings is None or not settings.is_configured():
             return True
 
+        with self.session.settings_lock:
+            if self.session.settings == settings:
+                self.settings = settings
+                return True
+            if ScholarConf.RESPONSE_CACHE is not None:
+                # Settings are only needed once a response is not cached
+                self.session.pending_settings = settings
+                self.settings = settings
+                return True
+            if not self._apply_settings(settings):
+                return False
+            self.session.settings = settings
+            return True
+
+    def _apply_pending_settings(self):
+        with self.session.settings_lock:
+            settings = self.session.pending_settings
+            if settings is None:
+                return
+            if self._apply_settings(settings):
+                self.session.settings = settings
+            self.session.pending_settings = None
+
+    def _apply_settings(self, settings):
         self.settings = settings
 
         # This is a bit of work. We need to actually retrieve the
@@ -945,7 +1210,7 @@ class ScholarQuerier(object):
         # Now parse the required stuff out of the form. We require the
         # "scisig" token to make the upload of our settings acceptable
         # to Google.
-        soup = BeautifulSoup(html)
+        soup = ScholarUtils.make_soup(html)
 
         tag = soup.find(name='form', attrs={'id': 'gs_settings_form'})
         if tag is None:
@@ -979,7 +1244,8 @@ class ScholarQuerier(object):
     def send_query(self, query):
         """
         This method initiates a search query (a ScholarQuery instance)
-        with subsequent parsing of the response.
+        with subsequent parsing of the response. Returns whether the
+        results page was retrieved.
         """
         self.clear_articles()
         self.query = query
@@ -989,9 +1255,33 @@ class ScholarQuerier(object):
                                        err_msg='results retrieval failed')
 
         if html is None:
-            return
+            return False
 
         self.parse(html)
+        self.get_citations_data(self.articles)
+        return True
+
+    def get_citations_data(self, articles):
+        """
+        Retrieves the citation export data of a list of articles. Up to
+        ScholarConf.CITATION_WORKERS articles are retrieved concurrently,
+        and this method returns once all of them were retrieved. Articles
+        rejected by the citation filter (if any) are skipped.
+        """
+        articles = [art for art in articles
+                    if art['url_citation'] is not None and art.citation_data is None and
+                    (self.citation_filter is None or self.citation_filter(art))]
+        num_workers = min(ScholarConf.CITATION_WORKERS, len(articles))
+        if num_workers <= 1:
+            for art in articles:
+                self.get_citation_data(art)
+            return
+
+        pool = ThreadPool(num_workers)
+        try:
+            pool.map(self.get_citation_data, articles)
+        finally:
+            pool.terminate()
 
     def get_citation_data(self, article):
         """
@@ -1022,7 +1312,6 @@ class ScholarQuerier(object):
         parser.parse(html)
 
     def add_article(self, art):
-        self.get_citation_data(art)
         self.articles.append(art)
 
     def clear_articles(self):
@@ -1053,7 +1342,21 @@ class ScholarQuerier(object):
             log_msg = 'HTTP response data follow'
         if err_msg is None:
             err_msg = 'request failed'
+        url = ScholarUtils.get_site_url(url)
+
+        cache = ScholarConf.RESPONSE_CACHE
+        if cache is not None and cache.get_ttl(url) > 0:
+            html = cache.get(url)
+            if html is not None:
+                ScholarUtils.log('info', 'using cached response for %s' % unquote(url))
+                return html
+            self._apply_pending_settings()
+        else:
+            cache = None
+
         try:
+            if ScholarConf.RATE_LIMITER is not None:
+                ScholarConf.RATE_LIMITER.acquire()
             ScholarUtils.log('info', 'requesting %s' % unquote(url))
 
             req = Request(url=url, headers={'User-Agent': ScholarConf.USER_AGENT})
@@ -1068,6 +1371,8 @@ class ScholarQuerier(object):
             ScholarUtils.log('debug', 'data:\n' + html.decode('utf-8')) # For Python 3
             ScholarUtils.log('debug', '<<<<' + '-'*68)
 
+            if cache is not None:
+                cache.put(url, html)
             return html
         except Exception as err:
             ScholarUtils.log('info', err_msg + ': %s' % err)
@@ -16,28 +16,46 @@
 #
 __author__ = "Rafael Ferreira da Silva"
 
+import functools
 import logging
 import os
-import time
 import urllib
 
 from datetime import date
 from externals import scholar
+from multiprocessing.pool import ThreadPool
 from operations import entry
 from tools import loader
+from tools import resolver
 from tools import utils
 
 log = logging.getLogger(__name__)
 
-# Import BeautifulSoup -- try 4 first, fall back to older
-try:
-    from bs4 import BeautifulSoup
-except ImportError:
-    try:
-        from BeautifulSoup import BeautifulSoup
-    except ImportError:
-        log.error('We need BeautifulSoup, sorry...')
-        exit(1)
+_WAIT_TIMEOUT = 24 * 3600
+
+
+class AuthorConf:
+    """Helper class for global author lookup settings."""
+
+    # Number of threads querying for authors metadata concurrently
+    WORKERS = 4
+
+    # Maximum number of results listed in a page of authors
+    PAGE_SIZE = 10
+
+    # Expected fraction of the queried authors having a profile. Queries are packed with up to PAGE_SIZE /
+    # EXPECTED_HIT_RATE authors, so that their profiles are expected to fit in a page
+    EXPECTED_HIT_RATE = 0.5
+
+    # Maximum length of the URL of a query
+    MAX_URL_LENGTH = 2000
+
+    # Whether variants of author names (e.g., 'Silva, R. F.' and 'Rafael Ferreira da Silva') are resolved into the
+    # same author (see tools.resolver)
+    RESOLVE_AUTHORS = True
+
+    # If set, a cache of author profiles (see tools.authorcache) consulted before querying for authors
+    PROFILE_CACHE = None
 
 
 def process(citations_file, output=None, plot=False):
@@ -48,86 +66,66 @@ def process(citations_file, output=None, plot=False):
     :param plot: whether charts should be plotted
     """
     log.info("Computing citations per author")
-    publication_entries, entries = loader.load_list_of_entries(citations_file)
+    publication_entries = list(loader.iter_publication_entries(citations_file))
 
     # sanity check
     if len(publication_entries) == 0:
         log.error("The citations file has no valid main publication entries.")
         exit(1)
 
-    if len(entries) == 0:
-        log.error("The citations file has no valid entries.")
-        exit(1)
-
-    log.debug("Loaded %s main publications, and %s citation entries." % (len(publication_entries), len(entries)))
+    log.debug("Loaded %s main publications." % len(publication_entries))
 
     # oldest publication year
     minor_year = date.today().year
-    pe_authors_list = []
+    pe_authors_list = set()
 
     for pe in publication_entries:
         if int(pe.year) < minor_year:
             minor_year = int(pe.year)
         # publication authors list
         for author in pe.authors.authors:
-            if author not in pe_authors_list and not author.first_name == 'others':
-                pe_authors_list.append(author)
+            if not author.first_name == 'others':
+                pe_authors_list.add(author)
 
     # create data analysis structure
     analyzer = Analyzer(minor_year, pe_authors_list)
 
-    for e in entries:
+    num_entries = 0
+    for e in loader.iter_citation_entries(citations_file):
         analyzer.process(e)
+        num_entries += 1
 
-    for pe in publication_entries:
-        pe.num_authors = analyzer.get_num_authors()
-        utils.write_output(pe, output)
-
-    for e in entries:
-        utils.write_output(e, output)
-
-    base_filename = os.path.splitext(citations_file[0])[0]
-    authors_file = open(base_filename + '.authors', 'w')
-
-    gs_authors = []
-    authors_bulk = []
-    num_queried_authors = 0
+    if num_entries == 0:
+        log.error("The citations file has no valid entries.")
+        exit(1)
+    log.debug("Processed %s citation entries." % num_entries)
+    if analyzer.resolver is not None:
+        analyzer.resolver.report()
 
-    for author in analyzer.all_authors:
-        if len(authors_bulk) < 10 and num_queried_authors < len(analyzer.all_authors):
-            authors_bulk.append(author)
-            num_queried_authors += 1
+    with utils.OutputWriter(output) as writer:
+        for pe in publication_entries:
+            pe.num_authors = analyzer.get_num_authors()
+            writer.write(pe)
 
-        else:
-            # Query for authors metadata
-            log.info("Querying for %s authors metadata." % len(authors_bulk))
-            author_query = AuthorScholarQuery(authors_bulk)
-            querier = AuthorScholarQuerier()
-            querier.send_query(author_query)
-
-            for a in querier.authors:
-                # check if author corresponds to request
-                author_to_remove = None
-                for ab in authors_bulk:
-                    if ab.first_name.split(' ')[0].lower() in a.first_name.lower():
-                        if not ab.last_name or not a.last_name or \
-                                        ab.last_name.split(' ')[-1].lower() in a.last_name.lower():
-                            author_to_remove = ab
-                            break
-                if not author_to_remove:
-                    continue
+        # write other entries (streamed again from the citations files)
+        for e in loader.iter_citation_entries(citations_file):
+            writer.write(e)
 
-                authors_bulk.remove(author_to_remove)
+    base_filename = os.path.splitext(citations_file[0])[0]
+    gs_authors = set()
 
+    session = scholar.ScholarSession()
+    try:
+        with open(base_filename + '.authors', 'w') as authors_file:
+            for a in _lookup_authors(session, analyzer.all_authors, cache=AuthorConf.PROFILE_CACHE):
                 # avoid duplicated google scholar entries
                 if a in gs_authors:
-                    log.info("Skipping duplicated author: %s" % author)
+                    log.info("Skipping duplicated author: %s" % a)
                     continue
                 utils.write_output(a.print_as_entry(), authors_file)
-                gs_authors.append(a)
-
-            authors_bulk = []
-            time.sleep(1)
+                gs_authors.add(a)
+    finally:
+        session.close()
 
     if plot:
         # plot solid gauge with number of authors having google scholar profile
@@ -148,69 +146,267 @@ def process(citations_file, output=None, plot=False):
         chart.render_to_file(gauge_filename)
         print "Number of authors having Google Scholar profile generated in: %s" % gauge_filename
 
+        # number of distinct and new citing authors per year
+        year_filename = base_filename + "-author-year.svg"
+        chart = pygal.Bar()
+        chart.title = "Number of Citing Authors per Year"
+        chart.x_labels = map(str, analyzer.get_years())
+        chart.add('Distinct Authors', analyzer.get_distinct_authors_per_year())
+        chart.add('New Authors', analyzer.get_new_authors_per_year())
+        chart.render_to_file(year_filename)
+        print "Number of Citing Authors per Year generated in: %s" % year_filename
+
+
+def _lookup_authors(session, authors, cache=None):
+    """
+    Query for the Google Scholar profiles of authors. Authors found in the profile cache are not queried. Other
+    authors are packed into queries (see _pack_authors()), which are sent concurrently (the request rate is limited by
+    ScholarConf.RATE_LIMITER). Authors without matching profile in a full page of results may have been left out of
+    the page, thus they are queried again in smaller queries; other authors are queried exactly once.
+    :param session: Google Scholar session
+    :param authors: list of authors
+    :param cache: cache of author profiles
+    :return: generator of the profiles (authors) matching an author, in the order of the authors
+    """
+    profiles = cache.get_profiles(authors) if cache else {}
+    pending_authors = [a for a in authors if a.key not in profiles]
+    log.info("Querying for %s authors metadata (%s cached authors)." %
+             (len(pending_authors), len(authors) - len(pending_authors)))
+
+    max_batch_size = max(1, int(AuthorConf.PAGE_SIZE / max(AuthorConf.EXPECTED_HIT_RATE, 0.01)))
+    num_queries = 0
+    num_queried_authors = 0
+    num_profiles = 0
+
+    pool = ThreadPool(max(1, AuthorConf.WORKERS))
+    try:
+        while pending_authors:
+            batches = _pack_authors(pending_authors, max_batch_size)
+            pending_authors = []
+            results = pool.imap(functools.partial(_query_authors_batch, session), batches)
+            for _ in batches:
+                # waiting with a timeout keeps the lookup interruptible (e.g., with Ctrl-C)
+                batch, num_results, batch_profiles = results.next(_WAIT_TIMEOUT)
+                num_queries += 1
+                if batch_profiles is None:
+                    # the query failed, thus the authors are neither cached nor written
+                    for a in batch:
+                        profiles[a.key] = None
+                    continue
+
+                num_matched = len([p for _, p in batch_profiles if p is not None])
+                log.debug("Query of %s authors: %s results, %s matching profiles (%.0f%% hit rate)." %
+                          (len(batch), num_results, num_matched, 100.0 * num_matched / len(batch)))
+                num_queried_authors += len(batch)
+                num_profiles += num_matched
+
+                page_full = num_results >= AuthorConf.PAGE_SIZE and len(batch) > 1
+                resolved_profiles = []
+                for a, profile in batch_profiles:
+                    if profile is None and page_full:
+                        pending_authors.append(a)
+                    else:
+                        profiles[a.key] = profile
+                        resolved_profiles.append((a, profile))
+                if cache and resolved_profiles:
+                    cache.put_profiles(resolved_profiles)
+
+            if pending_authors:
+                max_batch_size = max(1, max_batch_size // 2)
+                log.debug("Querying again for %s authors left out of full pages." % len(pending_authors))
+    finally:
+        pool.terminate()
+
+    if num_queries > 0:
+        log.info("Queried for authors metadata in %s queries (%.1f authors per query, %.1f%% hit rate)." %
+                 (num_queries, float(num_queried_authors) / num_queries,
+                  100.0 * num_profiles / max(1, num_queried_authors)))
+
+    for author in authors:
+        if profiles[author.key] is not None:
+            yield profiles[author.key]
+
+
+def _pack_authors(authors, max_batch_size):
+    """
+    Pack authors into queries of up to max_batch_size authors, whose URLs are at most AuthorConf.MAX_URL_LENGTH long.
+    :param authors: list of authors
+    :param max_batch_size: maximum number of authors per query
+    :return: list of batches (lists) of authors
+    """
+    batches = []
+    batch = []
+    url_length = 0
+    for a in authors:
+        term_length = len(AuthorScholarQuery.SEPARATOR) + len(AuthorScholarQuery.get_author_term(a))
+        if batch and (len(batch) >= max_batch_size or url_length + term_length > AuthorConf.MAX_URL_LENGTH):
+            batches.append(batch)
+            batch = []
+        if not batch:
+            url_length = len(AuthorScholarQuery.URL) - len(AuthorScholarQuery.SEPARATOR)
+        batch.append(a)
+        url_length += term_length
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _query_authors_batch(session, authors_batch):
+    """
+    Query for the Google Scholar profiles of a batch of authors.
+    :param session: Google Scholar session
+    :param authors_batch: list of authors
+    :return: list of authors, number of results in the page, and list of (author, profile) tuples for each author,
+             where profile is None if no profile in the page matches the author (or None if the query failed)
+    """
+    author_query = AuthorScholarQuery(authors_batch)
+    querier = AuthorScholarQuerier(session=session)
+    if not querier.send_query(author_query):
+        return authors_batch, 0, None
+
+    unmatched_authors = list(authors_batch)
+    profiles = []
+    for a in querier.authors:
+        # check if author corresponds to request
+        matched_author = None
+        for ab in unmatched_authors:
+            if ab.first_name.split(' ')[0].lower() in a.first_name.lower():
+                if not ab.last_name or not a.last_name or \
+                                ab.last_name.split(' ')[-1].lower() in a.last_name.lower():
+                    matched_author = ab
+                    break
+        if matched_author:
+            unmatched_authors.remove(matched_author)
+            profiles.append((matched_author, a))
+    profiles.extend((ab, None) for ab in unmatched_authors)
+    return authors_batch, len(querier.authors), profiles
+
 
 class Analyzer:
     def __init__(self, initial_year, pe_authors_list):
         """
-
-        :param initial_year:
+        Create the analysis structure of the authors citing the main publications. Authors are indexed by their
+        canonical keys (see entry.get_author_key()), so each author of an entry costs a few hash lookups. If
+        AuthorConf.RESOLVE_AUTHORS is set, variants of author names are indexed by the ID of the resolved author.
+        :param initial_year: year of the oldest main publication (older citations are counted in this year)
+        :param pe_authors_list: authors of the main publications
         """
         self.initial_year = initial_year
         self.current_year = date.today().year
-        self.pe_authors_list = pe_authors_list
+        self.resolver = resolver.AuthorResolver() if AuthorConf.RESOLVE_AUTHORS else None
+        self.pe_authors_keys = set(self._get_key(a) for a in pe_authors_list)
+        # citing authors (other than the main publication authors), in order of appearance
         self.all_authors = []
+        # index in all_authors of each citing author
+        self.authors_indexes = {}
+        # year of the oldest citation of each citing author (or None if none of its citations has a year)
+        self.first_seen_years = {}
+        # keys of the citing authors (other than the main publication authors) in each year
         self.yearly_authors = {}
         for i in range(initial_year, self.current_year + 1):
-            self.yearly_authors[i] = []
+            self.yearly_authors[i] = set()
+
+    def _get_key(self, author):
+        if self.resolver is not None:
+            return self.resolver.resolve(author)
+        return author.key
 
     def process(self, e):
         """
-
+        Process the authors of a citation entry.
         :param e: citation entry
         """
-        for author in e.authors.authors:
-            if author not in self.all_authors and author not in self.pe_authors_list:
-                self.all_authors.append(author)
-            if e.year:
-                citation_year = int(e.year)
-                if citation_year < self.initial_year:
-                    citation_year = self.initial_year
+        citation_year = None
+        if e.year:
+            citation_year = min(max(int(e.year), self.initial_year), self.current_year)
+            yearly_authors = self.yearly_authors[citation_year]
 
-                if author not in self.yearly_authors[citation_year]:
-                    self.yearly_authors[citation_year].append(author)
+        resolve = self.resolver.resolve if self.resolver is not None else None
+        for author in e.authors.authors:
+            key = resolve(author) if resolve else author.key
+            if key not in self.pe_authors_keys:
+                if key not in self.first_seen_years:
+                    self.first_seen_years[key] = citation_year
+                    self.authors_indexes[key] = len(self.all_authors)
+                    self.all_authors.append(author)
+                else:
+                    if citation_year and (self.first_seen_years[key] is None or
+                                          citation_year < self.first_seen_years[key]):
+                        self.first_seen_years[key] = citation_year
+                    if resolve:
+                        # the most complete name variant of an author is looked up
+                        index = self.authors_indexes[key]
+                        if author.key != self.all_authors[index].key and \
+                                _get_name_length(author) > _get_name_length(self.all_authors[index]):
+                            self.all_authors[index] = author
+                if citation_year:
+                    yearly_authors.add(key)
 
     def get_num_authors(self):
         return len(self.all_authors)
 
+    def get_years(self):
+        return range(self.initial_year, self.current_year + 1)
+
+    def get_distinct_authors_per_year(self):
+        """
+        Get the number of distinct citing authors (other than the main publication authors) in each year.
+        :return: list of number of authors (see get_years())
+        """
+        return [len(self.yearly_authors[year]) for year in self.get_years()]
+
+    def get_new_authors_per_year(self):
+        """
+        Get the number of citing authors (other than the main publication authors) first seen in each year, i.e.,
+        whose oldest citation is from that year.
+        :return: list of number of authors (see get_years())
+        """
+        counts = dict((year, 0) for year in self.get_years())
+        for year in self.first_seen_years.itervalues():
+            if year:
+                counts[year] += 1
+        return [counts[year] for year in self.get_years()]
+
+
+def _get_name_length(author):
+    last_name, first_names = author.key
+    return len(last_name) + sum(len(t) for t in first_names)
+
 
 class AuthorScholarQuery(scholar.ScholarQuery):
     """
 
     """
 
+    URL = 'https://scholar.google.com/citations?hl=en&view_op=search_authors&mauthors='
+
+    # authors are searched for with an OR query of their quoted names
+    SEPARATOR = urllib.quote("|")
+
     def __init__(self, authors_list):
         scholar.ScholarQuery.__init__(self)
         self._add_attribute_type('num_results', 'Results', 0)
 
         self.authors_list = authors_list
-        self.url = 'https://scholar.google.com/citations?hl=en&view_op=search_authors&mauthors='
+        self.url = self.URL
 
     def get_url(self):
-        authors_url = ""
-        for author in self.authors_list:
-            if len(authors_url) > 0:
-                authors_url += urllib.quote("|")
+        return self.url + self.SEPARATOR.join(self.get_author_term(author) for author in self.authors_list)
 
-            a_url = ""
-            if author.last_name:
-                a_url += author.first_name + ' ' + author.last_name
-            else:
-                a_url += author.first_name
-            a_url.replace(' ', '+')
-
-            authors_url += urllib.quote('"' + a_url + '"')
-
-        return self.url + authors_url
+    @staticmethod
+    def get_author_term(author):
+        """
+        Get the search term of an author: the quoted author name.
+        :param author: author
+        :return: URL-encoded search term
+        """
+        if author.last_name:
+            a_url = author.first_name + ' ' + author.last_name
+        else:
+            a_url = author.first_name
+        if isinstance(a_url, unicode):
+            a_url = a_url.encode('utf-8')
+        return urllib.quote('"' + a_url + '"')
 
 
 class AuthorScholarQuerier(scholar.ScholarQuerier):
@@ -218,11 +414,16 @@ class AuthorScholarQuerier(scholar.ScholarQuerier):
 
     """
 
-    def __init__(self):
-        scholar.ScholarQuerier.__init__(self)
+    def __init__(self, session=None):
+        scholar.ScholarQuerier.__init__(self, session=session)
         self.authors = []
 
     def send_query(self, query):
+        """
+        Query for authors, whose profiles are collected in the authors member.
+        :param query: authors query
+        :return: whether the results page was retrieved
+        """
         self.query = query
 
         html = self._get_http_response(url=query.get_url(),
@@ -230,14 +431,16 @@ class AuthorScholarQuerier(scholar.ScholarQuerier):
                                        err_msg='results retrieval failed')
 
         if html is None:
-            return
+            return False
 
         self.parse(html)
+        return True
 
     class Parser(scholar.ScholarQuerier.Parser):
 
         def parse(self, html):
-            self.soup = BeautifulSoup(html)
+            # only the author blocks are parsed
+            self.soup = scholar.ScholarUtils.make_soup(html, 'gsc_1usr')
             self._parse_globals()
             authors_list = self.soup.findAll(AuthorScholarQuerier._tag_results_checker)
             if len(authors_list) == 0:
@@ -44,23 +44,27 @@ def process(authors_file, output=None):
 
     # remove duplicated entries
     authors = []
+    authors_keys = set()
     for author in authors_list:
-        if author not in authors:
+        if author.key not in authors_keys:
+            authors_keys.add(author.key)
             authors.append(author)
 
     log.info("Creating authors map for %s authors." % len(authors))
 
     # build countries count map
     countries_count = {}
+    writer = utils.OutputWriter(output)
     for author in authors:
         if output:
-            utils.write_output(author.print_as_entry(), output)
+            writer.write(author.print_as_entry())
         if not author.country_code:
             continue
         if author.country_code in countries_count.keys():
             countries_count[author.country_code] += 1
         else:
             countries_count[author.country_code] = 1
+    writer.flush()
 
     base_filename = os.path.splitext(authors_file[0])[0]
     map_filename = base_filename + "-authorsmap.svg"
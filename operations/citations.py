@@ -16,74 +16,464 @@
 #
 __author__ = "Rafael Ferreira da Silva"
 
+import functools
 import logging
-import time
+import os
 
 from externals import scholar
+from multiprocessing.pool import ThreadPool
+from tools import bibtex
+from tools import dedup
+from tools import journal
 from tools import loader
 from tools import utils
 
 log = logging.getLogger(__name__)
 
+# number of citations per page
+PAGE_SIZE = 20
+_WAIT_TIMEOUT = 24 * 3600
 
-def process(titles, output=None):
+
+class CitationsConf:
+    """Helper class for global citations crawling settings."""
+
+    # Number of threads fetching citation pages concurrently
+    WORKERS = 4
+
+    # If set, a crawl is resumed from its journal, and only the pages of citations not completed are fetched
+    RESUME = False
+
+    # Journal file of crawls whose output is written to the standard output stream
+    JOURNAL_FILE = "citationxpert" + journal.JOURNAL_SUFFIX
+
+
+def process(titles, output=None, session=None, resume=None):
     """
-    Seek for the publication's citations.
+    Seek for the publication's citations. Completed pages of citations are recorded in a journal, from which an
+    interrupted crawl can be resumed.
     :param titles: publication titles
     :param output: output file object
+    :param session: Google Scholar session (by default, a new session is used)
+    :param resume: whether the crawl should be resumed from its journal (by default, CitationsConf.RESUME)
+    :return: whether the crawl was completed
     """
     log.info("Seeking for citations")
 
-    for publication in titles:
+    # a single session (cookies, keep-alive connections, and settings) is shared by all queries
+    own_session = session is None
+    if own_session:
+        session = scholar.ScholarSession()
+    settings = scholar.ScholarSettings()
+    settings.set_citation_format(scholar.ScholarSettings.CITFORM_BIBTEX)
 
-        scholar_query = scholar.SearchScholarQuery()
-        scholar_query.set_words(publication)
-        scholar_query.set_num_page_results(1)
+    if resume is None:
+        resume = CitationsConf.RESUME
+    crawl_journal = journal.CrawlJournal(_get_journal_filename(output), resume=resume)
+    completed = False
+    try:
+        num_incomplete = 0
+        for publication in titles:
+            if not _process_publication(session, settings, crawl_journal, publication, output):
+                num_incomplete += 1
+        completed = num_incomplete == 0
+    finally:
+        if own_session:
+            session.close()
+        crawl_journal.close(remove=completed)
+        if not completed:
+            log.warning("The crawl was not completed, it can be resumed with the '--resume' option from the "
+                        "journal: %s" % crawl_journal.filename)
+    return completed
 
-        settings = scholar.ScholarSettings()
-        settings.set_citation_format(scholar.ScholarSettings.CITFORM_BIBTEX)
 
-        querier = scholar.ScholarQuerier()
-        querier.apply_settings(settings)
-        querier.send_query(scholar_query)
+def update(citations_file, output=None):
+    """
+    Refresh the citations of the main publications of a citations file, fetching only the citations that are not in
+    the file yet. Citations are paged newest first, and paging stops once the number of new citations reported by
+    Google Scholar is reached. Only the BibTeX data of new citations (i.e., whose cluster ID and title are unknown)
+    is retrieved. The new citations are appended to the file (or written to the output file, if set, after the
+    contents of the file). The file is kept as it is, except for the number of citations and the cluster ID of the
+    main publications, which are edited in place.
+    :param citations_file: citations file
+    :param output: output file object
+    """
+    log.info("Updating citations of: %s" % citations_file)
+    entries = list(loader.iter_entries(citations_file))
+    publication_entries = [e for e in entries if e.main_publication]
 
-        if len(querier.articles) == 0:
-            log.warning("No entries found for the provided publication.")
-            continue
+    if len(publication_entries) == 0:
+        log.error("The citations file has no valid main publication entries.")
+        exit(1)
 
-        article = querier.articles[0]
-        num_citations = article.attrs['num_citations'][0]
-        url_citations = article.attrs['url_citations'][0]
+    known_fields = [(pe.citations, pe.cluster_id) for pe in publication_entries]
+    known_clusters = set(e.cluster_id for e in entries if e.cluster_id)
+    known_titles = set(dedup.normalize_title(e.title) for e in entries if e.title)
 
-        if num_citations == 0:
-            log.warning("The publication has no citations.")
-            continue
+    session = scholar.ScholarSession()
+    settings = scholar.ScholarSettings()
+    settings.set_citation_format(scholar.ScholarSettings.CITFORM_BIBTEX)
+
+    new_entries = []
+    try:
+        for pe in publication_entries:
+            new_entries.extend(_update_publication(session, settings, pe, known_clusters, known_titles))
+    finally:
+        session.close()
+    log.info("Found %s new citations." % len(new_entries))
+
+    with open(citations_file) as f:
+        data = f.read()
+    edited = False
+    for pe, (citations, cluster_id) in zip(publication_entries, known_fields):
+        values = []
+        if str(pe.citations) != str(citations):
+            values.append(('citations', pe.citations))
+        if pe.cluster_id != cluster_id:
+            values.append(('cluster_id', pe.cluster_id))
+        if values:
+            data = bibtex.set_fields(data, pe.cite_key, values)
+            edited = True
+    # new entries start on a new line
+    separator = '\n' if data and not data.endswith('\n') else ''
+
+    if output:
+        output.write(data + separator)
+        _write_entries(new_entries, output)
+    elif edited:
+        # the file is replaced once it is completely written
+        tmp_filename = citations_file + ".tmp"
+        with open(tmp_filename, 'w') as f:
+            f.write(data + separator)
+            _write_entries(new_entries, f)
+        os.rename(tmp_filename, citations_file)
+    elif new_entries:
+        with open(citations_file, 'a') as f:
+            f.write(separator)
+            _write_entries(new_entries, f)
+
+
+def _update_publication(session, settings, pe, known_clusters, known_titles):
+    """
+    Fetch the new citations of a main publication, and update its number of citations. If some new citations could
+    not be fetched, the number of citations is only increased by the number of new citations fetched, so that the
+    missing citations are sought again by the next update.
+    :param session: Google Scholar session
+    :param settings: Google Scholar settings
+    :param pe: main publication entry
+    :param known_clusters: set of known cluster IDs (updated with the new citations)
+    :param known_titles: set of known normalized titles (updated with the new citations)
+    :return: list of new citation entries
+    """
+    _, publication = _search_publication(session, settings, pe.title, citation_data=False)
+    if publication is None:
+        return []
+
+    num_citations = publication['num_citations']
+    num_known_citations = int(pe.citations or 0)
+    num_new_citations = num_citations - num_known_citations
+    if not pe.cluster_id:
+        pe.cluster_id = publication['cluster_id']
+
+    if num_new_citations <= 0:
+        log.info("No new citations for: %s" % pe.title)
+        pe.citations = num_citations
+        return []
+    log.info("Seeking for %s new citations of: %s" % (num_new_citations, pe.title))
 
-        start = 0
-        # main publication
-        main_bib_entry = loader.parse_bib_entry(article.citation_data, article.attrs['num_citations'][0],
-                                                article.attrs['url'][0])
-        main_bib_entry.main_publication = True
+    def is_new(article):
+        if article['cluster_id'] in known_clusters:
+            return False
+        return dedup.normalize_title(article['title']) not in known_titles
 
-        utils.write_output(main_bib_entry, output)
-        entries = []
+    new_entries = []
+    # new citations found (including those whose BibTeX data could not be retrieved)
+    num_found = 0
+    completed = True
+    start = 0
+    while start < num_citations and num_found < num_new_citations:
+        articles = _query_citations_page(session, settings, publication['url_citations'], start,
+                                         citation_filter=is_new, sort_by_date=True)
+        if articles is None:
+            log.warning("Unable to fetch the page of citations starting at: %s" % start)
+            completed = False
+            break
+        for article in articles:
+            if not is_new(article):
+                continue
+            num_found += 1
+            entries = list(_create_entries([_get_citation(article)]))
+            if not entries:
+                completed = False
+                continue
+            new_entries.extend(entries)
+            if article['cluster_id']:
+                known_clusters.add(article['cluster_id'])
+            known_titles.add(dedup.normalize_title(article['title']))
 
-        while start < num_citations:
-            citations_query = CitationsScholarQuery(url_citations, start=start)
-            querier = scholar.ScholarQuerier()
-            querier.apply_settings(settings)
-            querier.send_query(citations_query)
+        if len(articles) < PAGE_SIZE:
+            break
+        start += PAGE_SIZE
 
-            for article in querier.articles:
-                entries.append(loader.parse_bib_entry(article.citation_data, article.attrs['num_citations'][0],
-                                                      article.attrs['url'][0]))
+    if completed:
+        pe.citations = num_citations
+    else:
+        pe.citations = min(num_citations, num_known_citations + len(new_entries))
+        log.warning("Fetched %s of the %s new citations of: %s (the others will be sought by the next update)" %
+                    (len(new_entries), num_new_citations, pe.title))
+    return new_entries
 
-            start += 20
-            time.sleep(1)
 
-        # write to stdout or files
+def _write_entries(entries, output=None):
+    """
+    Write entries to the output.
+    :param entries: list of entries
+    :param output: output file object
+    """
+    with utils.OutputWriter(output) as writer:
         for e in entries:
-            utils.write_output(e, output)
+            writer.write(e)
+
+
+def _get_journal_filename(output=None):
+    """
+    Get the name of the journal file of a crawl.
+    :param output: output file object
+    :return: journal file name
+    """
+    if output and getattr(output, 'name', '<stdout>') != '<stdout>':
+        return output.name + journal.JOURNAL_SUFFIX
+    return CitationsConf.JOURNAL_FILE
+
+
+def _process_publication(session, settings, crawl_journal, title, output=None):
+    """
+    Seek for the citations of a publication.
+    :param session: Google Scholar session
+    :param settings: Google Scholar settings
+    :param crawl_journal: journal of the crawl
+    :param title: publication title
+    :param output: output file object
+    :return: whether all pages of citations were fetched
+    """
+    publication = crawl_journal.get_publication(title)
+    if publication is None:
+        searched, publication = _search_publication(session, settings, title)
+        if publication is None:
+            return searched
+        crawl_journal.add_publication(title, publication)
+
+    num_citations = publication['num_citations']
+    if num_citations == 0:
+        log.warning("The publication has no citations.")
+        return True
+
+    # main publication
+    main_bib_entry = loader.parse_bib_entry(publication['citation_data'], num_citations, publication['url'])
+    main_bib_entry.main_publication = True
+    main_bib_entry.cluster_id = publication['cluster_id']
+
+    # citation pages are fetched concurrently (the request rate is limited by ScholarConf.RATE_LIMITER), and
+    # recorded in the journal as soon as they are completed. Entries are written (in page order) as soon as all
+    # previous pages are completed, thus only out of order pages are kept in memory. Google Scholar may list fewer
+    # citations than reported (and never more than 1000), thus the citations end at the first short page: later
+    # pages are not fetched, and they are empty.
+    starts = range(0, num_citations, PAGE_SIZE)
+    completed_starts = crawl_journal.get_completed_pages(title)
+
+    # pages ready to be written, from the previous crawl or fetched (pages that could not be fetched are empty)
+    ready_pages = dict((start, crawl_journal.pop_page(title, start)) for start in completed_starts)
+    # index past the last citation (shared with the workers, which skip pages starting past it)
+    end = [num_citations]
+    for start, citations in ready_pages.iteritems():
+        _set_citations_end(end, start, citations)
+
+    pending_starts = [start for start in starts if start not in completed_starts and start < end[0]]
+    num_skipped = len([start for start in completed_starts if start < end[0]])
+    if num_skipped > 0:
+        log.info("Skipping %s pages of citations completed in a previous crawl." % num_skipped)
+    failed_starts = []
+
+    with utils.OutputWriter(output) as writer:
+        writer.write(main_bib_entry)
+        writer.flush()
+        position = _write_pages(writer, starts, ready_pages, 0)
+
+        if pending_starts:
+            fetch_page = functools.partial(_fetch_citations_page, session, settings, publication['url_citations'],
+                                           end)
+            pool = ThreadPool(max(1, min(CitationsConf.WORKERS, len(pending_starts))))
+            try:
+                results = pool.imap_unordered(fetch_page, pending_starts)
+                for _ in pending_starts:
+                    # waiting with a timeout keeps the crawl interruptible (e.g., with Ctrl-C)
+                    start, citations = results.next(_WAIT_TIMEOUT)
+                    if citations is None:
+                        failed_starts.append(start)
+                    else:
+                        crawl_journal.add_page(title, start, citations)
+                        _set_citations_end(end, start, citations)
+                    ready_pages[start] = citations
+                    position = _write_pages(writer, starts, ready_pages, position)
+            finally:
+                pool.terminate()
+
+    # pages past the last citation may have failed before the end was known
+    failed_starts = [failed_start for failed_start in failed_starts if failed_start < end[0]]
+    for failed_start in failed_starts:
+        log.warning("Unable to fetch the page of citations starting at: %s" % failed_start)
+    if end[0] < num_citations:
+        log.info("Google Scholar listed %s of the %s reported citations." % (end[0], num_citations))
+    return len(failed_starts) == 0
+
+
+def _set_citations_end(end, start, citations):
+    """
+    Update the index past the last citation of a publication from a fetched page of citations.
+    :param end: single-item list of the index past the last citation
+    :param start: index of the first citation in the page
+    :param citations: list of citations of the page
+    """
+    if citations is not None and len(citations) < PAGE_SIZE:
+        end[0] = min(end[0], start + len(citations))
+
+
+def _write_pages(writer, starts, ready_pages, position):
+    """
+    Write the entries of the pages of citations that are ready, up to the first page that is not ready. Written
+    pages are released from memory.
+    :param writer: output writer
+    :param starts: list of the indexes of the first citation of each page (in page order)
+    :param ready_pages: dictionary of the index of the first citation of each page ready to its list of citations
+    :param position: position in starts of the first page not written yet
+    :return: position in starts of the first page not written
+    """
+    written = False
+    while position < len(starts) and starts[position] in ready_pages:
+        for e in _create_entries(ready_pages.pop(starts[position]) or ()):
+            writer.write(e)
+        position += 1
+        written = True
+    if written:
+        writer.flush()
+    return position
+
+
+def _search_publication(session, settings, title, citation_data=True):
+    """
+    Search for a publication.
+    :param session: Google Scholar session
+    :param settings: Google Scholar settings
+    :param title: publication title
+    :param citation_data: whether the BibTeX data of the publication should be retrieved
+    :return: whether the search was completed (i.e., the results page and the BibTeX data were retrieved), and the
+             publication record (dictionary), or None if the publication was not found
+    """
+    scholar_query = scholar.SearchScholarQuery()
+    scholar_query.set_words(title)
+    scholar_query.set_num_page_results(1)
+
+    querier = scholar.ScholarQuerier(session=session)
+    if not citation_data:
+        querier.citation_filter = lambda article: False
+    querier.apply_settings(settings)
+    if not querier.send_query(scholar_query):
+        log.warning("Unable to search for the publication: %s" % title)
+        return False, None
+
+    if len(querier.articles) == 0:
+        log.warning("No entries found for the provided publication.")
+        return True, None
+
+    article = querier.articles[0]
+    if citation_data and not article.citation_data:
+        log.warning("Unable to retrieve the BibTeX data of the publication: %s" % title)
+        return False, None
+    return True, {'citation_data': article.citation_data,
+                  'num_citations': article.attrs['num_citations'][0],
+                  'url': article.attrs['url'][0],
+                  'url_citations': article.attrs['url_citations'][0],
+                  'cluster_id': article.attrs['cluster_id'][0]}
+
+
+def _fetch_citations_page(session, settings, url_citations, end, start):
+    """
+    Fetch a page of citations of a publication.
+    :param session: Google Scholar session
+    :param settings: Google Scholar settings
+    :param url_citations: URL of the publication citations
+    :param end: single-item list of the index past the last citation (pages starting past it are not fetched)
+    :param start: index of the first citation in the page
+    :return: index of the first citation in the page, and list of citations (see _get_citation()), or None if the
+             page or the BibTeX data of any of its citations could not be fetched
+    """
+    if start >= end[0]:
+        return start, []
+    articles = _query_citations_page(session, settings, url_citations, start)
+    if articles is None:
+        return start, None
+    for article in articles:
+        # pages with failed exports are not completed, so that they are fetched again when the crawl is resumed
+        if article['url_citation'] and not _is_bibtex(article.citation_data):
+            log.warning("Unable to retrieve the BibTeX data of the citation: %s" % article['url'])
+            return start, None
+    return start, [_get_citation(article) for article in articles]
+
+
+def _is_bibtex(data):
+    """
+    Check whether exported citation data is BibTeX (failed exports may return nothing or an HTML page instead).
+    :param data: exported citation data
+    :return: whether the data is a BibTeX entry
+    """
+    return bool(data) and data.lstrip().startswith('@')
+
+
+def _query_citations_page(session, settings, url_citations, start, citation_filter=None, sort_by_date=False):
+    """
+    Query a page of citations of a publication.
+    :param session: Google Scholar session
+    :param settings: Google Scholar settings
+    :param url_citations: URL of the publication citations
+    :param start: index of the first citation in the page
+    :param citation_filter: function telling whether the BibTeX data of an article should be retrieved (by default,
+                            the data of all articles is retrieved)
+    :param sort_by_date: whether the citations should be sorted by date (newest first) instead of relevance
+    :return: list of articles, or None if the page could not be fetched
+    """
+    log.debug("Fetching citations page starting at: %s" % start)
+    citations_query = CitationsScholarQuery(url_citations, start=start, sort_by_date=sort_by_date)
+    querier = scholar.ScholarQuerier(session=session)
+    querier.citation_filter = citation_filter
+    querier.apply_settings(settings)
+    if not querier.send_query(citations_query):
+        return None
+    return querier.articles
+
+
+def _get_citation(article):
+    """
+    Get the citation of an article, as recorded in the journal.
+    :param article: Google Scholar article
+    :return: (BibTeX data, number of citations, url, cluster ID) tuple
+    """
+    return (article.citation_data, article.attrs['num_citations'][0], article.attrs['url'][0],
+            article.attrs['cluster_id'][0])
+
+
+def _create_entries(citations):
+    """
+    Create the entries of a page of citations.
+    :param citations: list of citations (see _get_citation())
+    :return: generator of entries
+    """
+    for citation_data, num_citations, url, cluster_id in citations:
+        e = loader.parse_bib_entry(citation_data, num_citations, url) if citation_data else None
+        if e is None:
+            log.warning("Skipping citation without BibTeX data: %s" % url)
+            continue
+        e.cluster_id = cluster_id
+        yield e
 
 
 class CitationsScholarQuery(scholar.ScholarQuery):
@@ -91,11 +481,15 @@ class CitationsScholarQuery(scholar.ScholarQuery):
 
     """
 
-    def __init__(self, url_citations, start=0):
+    def __init__(self, url_citations, start=0, sort_by_date=False):
         scholar.ScholarQuery.__init__(self)
         self._add_attribute_type('num_results', 'Results', 0)
         self.url_citations = url_citations
         self.start = start
+        self.sort_by_date = sort_by_date
 
     def get_url(self):
-        return self.url_citations + "&num=20&start=%s" % self.start
+        url = self.url_citations + "&num=%s&start=%s" % (PAGE_SIZE, self.start)
+        if self.sort_by_date:
+            url += "&scisbd=1"
+        return url
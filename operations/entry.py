@@ -17,16 +17,61 @@
 #
 __author__ = "Rafael Ferreira da Silva"
 
+import operator
 import re
 import sys
+import unicodedata
 
 reload(sys);
 sys.setdefaultencoding("utf8")
 
 from tools.utils import *
+from tools.utils import lru_cache
 
 log = logging.getLogger(__name__)
 
+_NAME_PUNCTUATION_RE = re.compile(r'[^\w\s]|_', re.UNICODE)
+# characters escaped (or removed) when printing fields, in a single pass
+_ESCAPE_RE = re.compile(r'\\?([_#])|\$')
+
+# fields printed for an entry: (attribute name, field format)
+_ENTRY_FIELDS = (
+    ("authors", "\tauthor = {%s},\n"),
+    ("booktitle", "\tbooktitle = {{%s}},\n"),
+    ("journal", "\tjournal = {{%s}},\n"),
+    ("number", "\tnumber = {%s},\n"),
+    ("title", "\ttitle = {%s},\n"),
+    ("volume", "\tvolume = {%s},\n"),
+    ("year", "\tyear = {%s},\n"),
+    ("address", "\taddress = {%s},\n"),
+    ("annote", "\tannote = {%s},\n"),
+    ("chapter", "\tchapter = {%s},\n"),
+    ("crossref", "\tcrossref = {%s},\n"),
+    ("edition", "\tedition = {%s},\n"),
+    ("editors", "\teditor = {%s},\n"),
+    ("howpublished", "\thowpublished = {%s},\n"),
+    ("institution", "\tinstitution = {%s},\n"),
+    ("key", "\tkey = {%s},\n"),
+    ("month", "\tmonth = {%s},\n"),
+    ("note", "\tnote = {%s},\n"),
+    ("organization", "\torganization = {%s},\n"),
+    ("pages", "\tpages = {%s},\n"),
+    ("publisher", "\tpublisher = {%s},\n"),
+    ("school", "\tschool = {%s},\n"),
+    ("series", "\tseries = {%s},\n"),
+    ("type", "\ttype = {%s},\n"),
+    ("url", "\turl = {%s},\n"),
+    ("doi", "\tdoi = {%s},\n"),
+    # CitationXpert properties
+    ("main_publication", "\tmain_publication = {%s},\n"),
+    ("citations", "\tcitations = {%s},\n"),
+    ("cluster_id", "\tcluster_id = {%s},\n"),
+    ("op_self", "\top_self = {%s},\n"),
+    ("h_index", "\th_index = {%s},\n"),
+    ("num_authors", "\tnum_authors = {%s},\n"),
+)
+_get_entry_fields = operator.attrgetter(*[attr_name for attr_name, _ in _ENTRY_FIELDS])
+
 
 class EntryType:
     ARTICLE = "article"
@@ -54,13 +99,18 @@ def create_entry_type_dict():
     }
 
 
-class Entry:
+class Entry(object):
+    __slots__ = ('entry_type', 'cite_key', 'address', 'annote', 'authors', 'booktitle', 'chapter', 'crossref',
+                 'edition', 'editors', 'howpublished', 'institution', 'journal', 'key', 'month', 'note', 'number',
+                 'organization', 'pages', 'publisher', 'school', 'series', 'title', 'type', 'url', 'volume', 'year',
+                 'doi', 'main_publication', 'citations', 'cluster_id', 'op_self', 'h_index', 'num_authors')
+
     def __init__(self, entry_type=None, cite_key=None, address=None, annote=None, authors=None, booktitle=None,
                  chapter=None, crossref=None, edition=None, editor=None, howpublished=None, institution=None,
                  journal=None, key=None, month=None, note=None, number=None, organization=None, pages=None,
                  publisher=None, school=None, series=None, title=None, type=None, url=None, volume=None,
-                 year=None, doi=None, main_publication=False, citations=None, op_self=None, h_index=None,
-                 num_authors=None):
+                 year=None, doi=None, main_publication=False, citations=None, cluster_id=None, op_self=None,
+                 h_index=None, num_authors=None):
         """
         Create a bib entry.
         :param entry_type: type of the entry (e.g., article, inproceedings, etc.)
@@ -92,13 +142,14 @@ class Entry:
         :param year: publication year
         :param doi: document object identifier
         :param citations: number of citations (not standard field)
+        :param cluster_id: Google Scholar cluster ID of the publication (not standard field)
         """
-        self.entry_type = entry_type
+        self.entry_type = _intern(entry_type)
         self.cite_key = cite_key
-        self.address = address
+        self.address = _intern(address)
         self.annote = annote
         self.authors = Authors(authors_list=authors)
-        self.booktitle = _parse_booktitle(booktitle)
+        self.booktitle = _intern(_parse_booktitle(booktitle))
         self.chapter = chapter
         self.crossref = crossref
         self.edition = edition
@@ -107,73 +158,46 @@ class Entry:
         else:
             self.editors = None
         self.howpublished = howpublished
-        self.institution = institution
-        self.journal = journal
+        self.institution = _intern(institution)
+        self.journal = _intern(journal)
         self.key = key
-        self.month = month
+        self.month = _intern(month)
         self.note = note
         self.number = number
-        self.organization = organization
+        self.organization = _intern(organization)
         self.pages = _parse_pages(pages)
-        self.publisher = publisher
-        self.school = school
-        self.series = series
+        self.publisher = _intern(publisher)
+        self.school = _intern(school)
+        self.series = _intern(series)
         self.title = title
-        self.type = type
+        self.type = _intern(type)
         self.url = url
         self.volume = volume
-        self.year = year
+        self.year = _intern(year)
         self.doi = doi
         # Entry internal properties
         self.main_publication = main_publication
         self.citations = citations
+        self.cluster_id = cluster_id
         self.op_self = op_self
         self.h_index = h_index
         self.num_authors = num_authors
 
     def __str__(self):
-        entry_str = "@%s{%s,\n" % (self.entry_type, self.cite_key)
-        entry_str += _print_field("author", self.authors)
-        entry_str += _print_field("booktitle", self.booktitle, capitals=True)
-        entry_str += _print_field("journal", self.journal, capitals=True)
-        entry_str += _print_field("number", self.number)
-        entry_str += _print_field("title", self.title)
-        entry_str += _print_field("volume", self.volume)
-        entry_str += _print_field("year", self.year)
-        entry_str += _print_field("address", self.address)
-        entry_str += _print_field("annote", self.annote)
-        entry_str += _print_field("chapter", self.chapter)
-        entry_str += _print_field("crossref", self.crossref)
-        entry_str += _print_field("edition", self.edition)
-        entry_str += _print_field("editor", self.editors)
-        entry_str += _print_field("howpublished", self.howpublished)
-        entry_str += _print_field("institution", self.institution)
-        entry_str += _print_field("key", self.key)
-        entry_str += _print_field("month", self.month)
-        entry_str += _print_field("note", self.note)
-        entry_str += _print_field("organization", self.organization)
-        entry_str += _print_field("pages", self.pages)
-        entry_str += _print_field("publisher", self.publisher)
-        entry_str += _print_field("school", self.school)
-        entry_str += _print_field("series", self.series)
-        entry_str += _print_field("type", self.type)
-        entry_str += _print_field("url", self.url)
-        entry_str += _print_field("doi", self.doi)
-        # CitationXpert properties
-        entry_str += _print_field("main_publication", self.main_publication)
-        entry_str += _print_field("citations", self.citations)
-        entry_str += _print_field("op_self", self.op_self)
-        entry_str += _print_field("h_index", self.h_index)
-        entry_str += _print_field("num_authors", self.num_authors)
-
-        entry_str += "}\n\n"
-        return entry_str
+        parts = ["@%s{%s,\n" % (self.entry_type, self.cite_key)]
+        for (_, field_format), value in zip(_ENTRY_FIELDS, _get_entry_fields(self)):
+            if value is not None:
+                parts.append(field_format % _escape_value(value))
+        parts.append("}\n\n")
+        return "".join(parts)
 
     def __repr__(self):
         return self.__str__
 
 
-class Authors:
+class Authors(object):
+    __slots__ = ('authors',)
+
     def __init__(self, authors_list=None):
         """
 
@@ -185,21 +209,28 @@ class Authors:
             for author in authors_list.split(" and "):
                 self.authors.append(Author(author.strip()))
 
-    def has_authors(self, authors):
+    def get_keys(self):
+        """
+        Get the canonical keys of the authors ('others' is not an author, and thus is ignored).
+        :return: set of author keys
+        """
+        return frozenset(author.key for author in self.authors if not author.first_name == 'others')
 
-        for a in authors.authors:
-            for author in self.authors:
-                if a.first_name == author.first_name and a.last_name == author.last_name:
-                    return True
+    def has_authors(self, authors):
+        """
+        Verify whether any of the authors is in this list of authors.
+        :param authors: Authors object, or set of author keys (see get_keys()) to avoid recomputing them per call
+        :return: whether an author was found
+        """
+        if isinstance(authors, Authors):
+            authors = authors.get_keys()
+        for author in self.authors:
+            if author.key in authors:
+                return True
         return False
 
     def __str__(self):
-        authors = ""
-        for author in self.authors:
-            if len(authors) > 0:
-                authors += " and "
-            authors += author.__str__()
-        return authors
+        return " and ".join([author.__str__() for author in self.authors])
 
     def __repr__(self):
         return self.__str__
@@ -208,47 +239,21 @@ class Authors:
         return len(self.authors)
 
 
-class Author:
+class Author(object):
+    __slots__ = ('first_name', 'last_name', 'key', 'affiliation', 'email', 'country_code', 'citations', 'keywords')
+
     def __init__(self, author_name):
         """
         Create an author object with first and last names.
         :param author_name: name of a single author
         """
-        self.first_name = ""
-        self.last_name = None
+        self.first_name, self.last_name, self.key = _parse_author_name(author_name)
         self.affiliation = None
         self.email = None
         self.country_code = None
         self.citations = 0
         self.keywords = None
 
-        if "," in author_name:
-            s = author_name.split(",")
-            self.first_name = s[1].strip()
-            self.last_name = s[0].strip()
-        else:
-            s = author_name.split(" ")
-            if len(s) == 2:
-                self.first_name = s[0].strip()
-                self.last_name = s[1].strip()
-            elif len(s) > 2:
-                index = len(s) - 1
-                value = s[len(s) - 2]
-                if len(value) <= 2 and not value.endswith('.'):
-                    self.last_name = value + " " + s[len(s) - 1]
-                    index -= 1
-                else:
-                    self.last_name = s[len(s) - 1]
-                for i in range(0, index):
-                    if len(self.first_name) > 0:
-                        self.first_name += " "
-                    self.first_name += s[i]
-            else:
-                self.first_name = author_name
-                self.last_name = None
-                if not author_name.lower() == "others":
-                    log.warning("Unable to find last name: %s" % author_name)
-
     def print_as_entry(self):
         entry_str = "@author{\n"
         entry_str += _print_field("first", self.first_name)
@@ -262,10 +267,13 @@ class Author:
         return entry_str
 
     def __eq__(self, other):
-        if self.last_name:
-            return self.last_name == other.last_name and self.first_name == other.first_name
-        else:
-            return self.first_name == other.first_name
+        return isinstance(other, Author) and self.key == other.key
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.key)
 
     def __str__(self):
         if self.last_name:
@@ -277,6 +285,83 @@ class Author:
         return self.__str__
 
 
+@lru_cache(maxsize=200000)
+def _parse_author_name(author_name):
+    """
+    Parse an author name into first and last names. Results are memoized, since the same names occur many times
+    in a corpus.
+    :param author_name: name of a single author (e.g., 'Silva, Rafael' or 'Rafael Silva')
+    :return: first name, last name, and canonical author key
+    """
+    first_name = ""
+
+    if "," in author_name:
+        s = author_name.split(",")
+        first_name = s[1].strip()
+        last_name = s[0].strip()
+    else:
+        s = author_name.split(" ")
+        if len(s) == 2:
+            first_name = s[0].strip()
+            last_name = s[1].strip()
+        elif len(s) > 2:
+            index = len(s) - 1
+            value = s[len(s) - 2]
+            if len(value) <= 2 and not value.endswith('.'):
+                last_name = value + " " + s[len(s) - 1]
+                index -= 1
+            else:
+                last_name = s[len(s) - 1]
+            for i in range(0, index):
+                if len(first_name) > 0:
+                    first_name += " "
+                first_name += s[i]
+        else:
+            first_name = author_name
+            last_name = None
+            if not author_name.lower() == "others":
+                log.warning("Unable to find last name: %s" % author_name)
+
+    return _intern(first_name), _intern(last_name), get_author_key(first_name, last_name)
+
+
+def get_author_key(first_name, last_name):
+    """
+    Get the canonical key of an author: the normalized last name (case, accents, and punctuation removed) and the
+    normalized tokens of the first name (e.g., 'Ferreira da Silva, R. F.' -> ('ferreira da silva', ('r', 'f'))).
+    :param first_name: author first name
+    :param last_name: author last name
+    :return: hashable author key
+    """
+    return _normalize_name(last_name), tuple(_normalize_name(first_name).split())
+
+
+def _normalize_name(name):
+    """
+    Normalize a name for comparison.
+    :param name: name
+    :return: lower case name without accents and punctuation
+    """
+    if not name:
+        return u''
+    if isinstance(name, str):
+        name = name.decode('utf-8', 'ignore')
+    name = unicodedata.normalize('NFKD', name)
+    name = u''.join(c for c in name if not unicodedata.combining(c))
+    return u' '.join(_NAME_PUNCTUATION_RE.sub(u' ', name.lower()).split())
+
+
+def _intern(value):
+    """
+    Intern a string value, so repeated values (e.g., author names and venues) share a single object.
+    :param value: field value
+    :return: the interned value (values other than byte strings are returned unchanged)
+    """
+    if type(value) is str:
+        return intern(value)
+    return value
+
+
 def _parse_pages(pages):
     """
     Parse the page number to a 2-dashes format (e.g. 100--120).
@@ -313,14 +398,33 @@ def _print_field(field_name, field_value, capitals=False):
     :return: field in bib format or blank if field is None
     """
     if field_value is not None:
-        # field_value = str(u' '.join((field_value, '')).encode('utf-8').strip())
-        field_value = str(field_value).replace("_", "\_")
-        field_value = str(field_value).replace("\\\\_", "\_")
-        field_value = str(field_value).replace("#", "\#")
-        field_value = str(field_value).replace("\\\\#", "\#")
-        field_value = str(field_value).replace("$", "")
+        field_value = _escape_value(field_value)
         if capitals:
             return "\t%s = {{%s}},\n" % (field_name, field_value)
         else:
             return "\t%s = {%s},\n" % (field_name, field_value)
     return ""
+
+
+def _escape_value(value):
+    """
+    Convert a field value to string, escaping '_' and '#' (unless already escaped) and removing '$'.
+    :param value: field value
+    :return: escaped string
+    """
+    value = str(value)
+    if '_' in value or '#' in value or '$' in value:
+        value = _ESCAPE_RE.sub(_escape_character, value)
+    return value
+
+
+def _escape_character(match):
+    """
+    Replacement of an _ESCAPE_RE match.
+    :param match: match object
+    :return: escaped character, or blank for '$'
+    """
+    c = match.group(1)
+    if c:
+        return "\\" + c
+    return ""
@@ -34,17 +34,13 @@ def process(citations_file, output=None, plot=False):
     :param plot: whether charts should be plotted
     """
     log.info("Computing citations h-index")
-    publication_entries, entries = loader.load_list_of_entries(citations_file)
+    publication_entries = list(loader.iter_publication_entries(citations_file))
 
     # sanity check
     if len(publication_entries) == 0:
         log.error("The citations file has no valid main publication entries.")
         exit(1)
 
-    if len(entries) == 0:
-        log.error("The citations file has no valid entries.")
-        exit(1)
-
     # oldest publication year
     minor_year = date.today().year
 
@@ -55,18 +51,25 @@ def process(citations_file, output=None, plot=False):
     # create data analysis structure
     analyzer = Analyzer(minor_year)
 
-    for e in entries:
+    num_entries = 0
+    for e in loader.iter_citation_entries(citations_file):
         analyzer.process(e)
+        num_entries += 1
+
+    if num_entries == 0:
+        log.error("The citations file has no valid entries.")
+        exit(1)
 
     # write publication entries to output
     h_index = analyzer.get_overall_index()
-    for pe in publication_entries:
-        pe.h_index = h_index
-        utils.write_output(pe, output)
-
-    # write other entries
-    for e in entries:
-        utils.write_output(e, output)
+    with utils.OutputWriter(output) as writer:
+        for pe in publication_entries:
+            pe.h_index = h_index
+            writer.write(pe)
+
+        # write other entries (streamed again from the citations files)
+        for e in loader.iter_citation_entries(citations_file):
+            writer.write(e)
 
     if plot:
         # Plot h-index evolution
@@ -0,0 +1,254 @@
+#
+# Copyright 2016 Rafael Ferreira da Silva
+# http://www.rafaelsilva.com/tools
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+__author__ = "Rafael Ferreira da Silva"
+
+import logging
+import os
+import Queue
+import threading
+import time
+
+from externals import scholar
+from operations import citations
+from tools import journal
+
+log = logging.getLogger(__name__)
+
+STATUS_SUFFIX = ".status"
+
+# maximum number of seconds a worker waits before checking for items ready to be retried again
+_POLL_INTERVAL = 1
+
+
+class ManifestConf:
+    """Helper class for global manifest crawling settings."""
+
+    # Number of manifest items crawled concurrently
+    WORKERS = 2
+
+    # Number of times a failed item is retried (resuming from its journal)
+    RETRIES = 3
+
+    # Number of seconds waited before the first retry of an item (doubled at each retry)
+    RETRY_DELAY = 60
+
+
+class ItemStatus:
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class ManifestItem(object):
+    __slots__ = ('title', 'output', 'researcher', 'status', 'attempts')
+
+    def __init__(self, title, output, researcher=None):
+        """
+        Create a manifest item.
+        :param title: publication title
+        :param output: output file name
+        :param researcher: researcher the publication belongs to
+        """
+        self.title = title
+        self.output = output
+        self.researcher = researcher
+        self.status = ItemStatus.PENDING
+        self.attempts = 0
+
+    def __str__(self):
+        return "\t".join([self.title, self.output, self.researcher or "", self.status, str(self.attempts)])
+
+
+def process(manifest_file):
+    """
+    Crawl the citations of the publications listed in a manifest file. Each line of the manifest lists a publication
+    title, the output file of its citations, and optionally a researcher, separated by tabs. Items are crawled by
+    a queue of workers (see ManifestConf), all sharing the global request rate limit and a Google Scholar session.
+    Crawls are resumed from the journal of their item, if any (i.e., after a failed attempt or an interrupted run).
+    Failed items are put back in the queue, and retried once their retry delay is elapsed. The status of each item is
+    kept in a status file, and items already done are skipped when the manifest is processed again.
+    :param manifest_file: manifest file
+    """
+    items = load_manifest(manifest_file)
+    status_filename = manifest_file + STATUS_SUFFIX
+    _load_status(status_filename, items)
+
+    pending_items = [item for item in items if item.status != ItemStatus.DONE]
+    log.info("Crawling %s publications from the manifest (%s already done)." %
+             (len(pending_items), len(items) - len(pending_items)))
+
+    # items are queued by the time from which they can be crawled (and their order in the manifest)
+    work_queue = Queue.PriorityQueue()
+    for order, item in enumerate(pending_items):
+        work_queue.put((0, order, item))
+
+    session = scholar.ScholarSession()
+    status_lock = threading.Lock()
+    # number of items neither done nor failed (i.e., queued, waiting to be retried, or being crawled)
+    unfinished = [len(pending_items)]
+    workers = []
+    for _ in range(min(ManifestConf.WORKERS, len(pending_items))):
+        worker = threading.Thread(target=_worker,
+                                  args=(work_queue, session, items, status_filename, status_lock, unfinished))
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+
+    try:
+        for worker in workers:
+            # joining with a timeout keeps the crawl interruptible (e.g., with Ctrl-C)
+            while worker.is_alive():
+                worker.join(1)
+    finally:
+        session.close()
+        with status_lock:
+            _write_status(status_filename, items)
+
+    num_failed = len([item for item in items if item.status == ItemStatus.FAILED])
+    if num_failed > 0:
+        log.warning("Failed to crawl %s publications, see: %s" % (num_failed, status_filename))
+    log.info("Manifest status written to: %s" % status_filename)
+
+
+def load_manifest(manifest_file):
+    """
+    Load the items of a manifest file. Empty lines and lines starting with '#' are ignored.
+    :param manifest_file: manifest file
+    :return: list of manifest items
+    """
+    items = []
+    with open(manifest_file) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            fields = [field.strip() for field in line.split('\t')]
+            if len(fields) < 2 or not fields[0] or not fields[1]:
+                log.error("Invalid manifest line %s (expected: title, output file, and researcher separated by "
+                          "tabs): %s" % (line_number, line))
+                exit(1)
+            items.append(ManifestItem(fields[0], fields[1], fields[2] if len(fields) > 2 and fields[2] else None))
+    return items
+
+
+def _worker(work_queue, session, items, status_filename, status_lock, unfinished):
+    """
+    Crawl manifest items from the work queue until all items are done or failed. Failed items are put back in the
+    queue, thus workers crawl other items while they wait to be retried, and workers finding the queue empty wait for
+    the items being crawled by other workers, which may fail and be retried.
+    :param work_queue: priority queue of (time from which the item can be crawled, order, manifest item) tuples
+    :param session: Google Scholar session
+    :param items: list of all manifest items
+    :param status_filename: status file name
+    :param status_lock: lock of the items status
+    :param unfinished: single-element list with the number of items neither done nor failed
+    """
+    while True:
+        try:
+            not_before, order, item = work_queue.get_nowait()
+        except Queue.Empty:
+            with status_lock:
+                if unfinished[0] == 0:
+                    return
+            time.sleep(_POLL_INTERVAL)
+            continue
+
+        wait_time = not_before - time.time()
+        if wait_time > 0:
+            # no item is ready yet, and items failed meanwhile may be ready earlier
+            work_queue.put((not_before, order, item))
+            time.sleep(min(wait_time, _POLL_INTERVAL))
+            continue
+
+        with status_lock:
+            item.status = ItemStatus.RUNNING
+            item.attempts += 1
+            _write_status(status_filename, items)
+
+        completed = _crawl_item(item, session)
+
+        with status_lock:
+            if completed:
+                item.status = ItemStatus.DONE
+            elif item.attempts > ManifestConf.RETRIES:
+                item.status = ItemStatus.FAILED
+            else:
+                item.status = ItemStatus.PENDING
+            if item.status != ItemStatus.PENDING:
+                unfinished[0] -= 1
+            _write_status(status_filename, items)
+
+        if item.status == ItemStatus.PENDING:
+            delay = ManifestConf.RETRY_DELAY * 2 ** (item.attempts - 1)
+            log.info("Retrying '%s' in %s seconds." % (item.title, delay))
+            work_queue.put((time.time() + delay, order, item))
+
+
+def _crawl_item(item, session):
+    """
+    Crawl the citations of a manifest item. The crawl is resumed from the journal of the item, if any (i.e., the item
+    was not completed in a previous attempt or run), or if CitationsConf.RESUME is set.
+    :param item: manifest item
+    :param session: Google Scholar session
+    :return: whether the crawl was completed
+    """
+    log.info("Crawling citations of '%s'%s (attempt %s)." %
+             (item.title, " for %s" % item.researcher if item.researcher else "", item.attempts))
+    try:
+        output_dir = os.path.dirname(item.output)
+        if output_dir and not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        resume = citations.CitationsConf.RESUME or os.path.exists(item.output + journal.JOURNAL_SUFFIX)
+        with open(item.output, 'w') as output:
+            return citations.process([item.title], output=output, session=session, resume=resume)
+    except Exception as e:
+        log.error("Unable to crawl '%s': %s" % (item.title, e))
+        return False
+
+
+def _load_status(status_filename, items):
+    """
+    Load the status of the manifest items from a previous run. Only items done are kept as such.
+    :param status_filename: status file name
+    :param items: list of manifest items
+    """
+    if not os.path.exists(status_filename):
+        return
+    done = set()
+    with open(status_filename) as f:
+        for line in f:
+            fields = line.rstrip('\r\n').split('\t')
+            if len(fields) >= 4 and fields[3] == ItemStatus.DONE:
+                done.add((fields[0], fields[1]))
+    for item in items:
+        if (item.title, item.output) in done and os.path.exists(item.output):
+            item.status = ItemStatus.DONE
+
+
+def _write_status(status_filename, items):
+    """
+    Write the status of the manifest items (one tab-separated line per item: title, output file, researcher, status,
+    and number of attempts). The file is replaced once it is completely written.
+    :param status_filename: status file name
+    :param items: list of manifest items
+    """
+    tmp_filename = status_filename + ".tmp"
+    with open(tmp_filename, 'w') as f:
+        for item in items:
+            f.write(str(item) + "\n")
+    os.rename(tmp_filename, status_filename)
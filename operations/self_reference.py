@@ -34,26 +34,24 @@ def process(citations_file, output=None, plot=False):
     :param output: output file object
     :param plot: whether charts should be plotted
     """
-    publication_entries, entries = loader.load_list_of_entries(citations_file)
+    publication_entries = list(loader.iter_publication_entries(citations_file))
 
     # sanity check
     if len(publication_entries) == 0:
         log.error("The citations file has no valid main publication entries.")
         exit(1)
 
-    if len(entries) == 0:
-        log.error("The citations file has no valid entries.")
-        exit(1)
-
     # oldest publication year
     minor_year = date.today().year
 
     # list of publication authors
     publication_authors = entry.Authors()
 
+    writer = utils.OutputWriter(output)
+
     # write publication entries to output
     for pe in publication_entries:
-        utils.write_output(pe, output)
+        writer.write(pe)
         publication_authors.authors.extend(pe.authors.authors)
         if int(pe.year) < minor_year:
             minor_year = int(pe.year)
@@ -61,10 +59,16 @@ def process(citations_file, output=None, plot=False):
     # create data analysis structure
     analyzer = Analyzer(minor_year)
 
-    for e in entries:
-        e.op_self = e.authors.has_authors(publication_authors)
+    num_entries = 0
+    for e in classify_entries(loader.iter_citation_entries(citations_file), publication_authors):
         analyzer.process_entry(e)
-        utils.write_output(e, output)
+        writer.write(e)
+        num_entries += 1
+
+    if num_entries == 0:
+        log.error("The citations file has no valid entries.")
+        exit(1)
+    writer.flush()
 
     if plot:
         # Plot all files from the analyses
@@ -99,6 +103,20 @@ def process(citations_file, output=None, plot=False):
         _generate_per_year_per_type_chart(pygal, analyzer, base_filename + "-self-self-year.svg", True)
 
 
+def classify_entries(entries, publication_authors):
+    """
+    Classify citation entries as self-references (op_self) when they share at least one author with the main
+    publications. The publication author keys are hashed once, so each entry costs one lookup per author.
+    :param entries: iterable of citation entries
+    :param publication_authors: authors of the main publications
+    :return: generator of the classified entries
+    """
+    authors_keys = publication_authors.get_keys()
+    for e in entries:
+        e.op_self = e.authors.has_authors(authors_keys)
+        yield e
+
+
 def _generate_per_year_per_type_chart(pygal, analyzer, filename, is_self):
     """
 
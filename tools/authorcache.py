@@ -0,0 +1,181 @@
+#
+# Copyright 2016 Rafael Ferreira da Silva
+# http://www.rafaelsilva.com/tools
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+__author__ = "Rafael Ferreira da Silva"
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from operations import entry
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.citationxpert', 'authors.db')
+
+_DAY = 24 * 3600
+
+# number of seconds after which cached profiles are stale
+DEFAULT_MAX_AGE = 30 * _DAY
+
+# number of seconds after which authors without profile are queried again (profiles may be created meanwhile)
+DEFAULT_NEGATIVE_MAX_AGE = 7 * _DAY
+
+# maximum number of variables of a SQLite statement
+_MAX_VARIABLES = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    name_key TEXT PRIMARY KEY,
+    found INTEGER NOT NULL,
+    first_name TEXT,
+    last_name TEXT,
+    affiliation TEXT,
+    email TEXT,
+    country_code TEXT,
+    citations TEXT,
+    keywords TEXT,
+    updated REAL NOT NULL
+)
+"""
+
+
+class AuthorProfileCache(object):
+    def __init__(self, filename=DEFAULT_CACHE_FILE, max_age=DEFAULT_MAX_AGE, negative_max_age=DEFAULT_NEGATIVE_MAX_AGE):
+        """
+        Create a persistent (SQLite) cache of the Google Scholar profiles of authors, keyed by the canonical name of
+        the queried authors. Authors found without profile are also cached, so that they are not queried again until
+        their entry is stale. The cache is thread-safe.
+        :param filename: database file name
+        :param max_age: number of seconds after which cached profiles are stale
+        :param negative_max_age: number of seconds after which cached authors without profile are stale
+        """
+        self.filename = filename
+        self.max_age = max_age
+        self.negative_max_age = negative_max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        dirname = os.path.dirname(os.path.abspath(filename))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute(_SCHEMA)
+        self._db.commit()
+
+    def get_profiles(self, authors):
+        """
+        Get the cached profiles of authors. Stale entries are ignored.
+        :param authors: list of authors
+        :return: dictionary of the key of each cached author to its profile (author), or None if the author has no
+                 profile
+        """
+        keys = dict((_get_name_key(a), a.key) for a in authors)
+        names = keys.keys()
+        now = time.time()
+        profiles = {}
+
+        with self._lock:
+            for i in range(0, len(names), _MAX_VARIABLES):
+                chunk = names[i:i + _MAX_VARIABLES]
+                rows = self._db.execute("SELECT name_key, found, first_name, last_name, affiliation, email, "
+                                        "country_code, citations, keywords, updated FROM profiles WHERE name_key IN "
+                                        "(%s)" % ",".join("?" * len(chunk)), chunk)
+                for row in rows:
+                    max_age = self.max_age if row[1] else self.negative_max_age
+                    if now - row[9] > max_age:
+                        continue
+                    profiles[keys[row[0]]] = _create_profile(row) if row[1] else None
+            self.hits += len(profiles)
+            self.misses += len(authors) - len(profiles)
+        return profiles
+
+    def put_profiles(self, profiles):
+        """
+        Store the profiles of queried authors.
+        :param profiles: list of (queried author, profile) tuples, where profile is None if the author has no profile
+        """
+        now = time.time()
+        rows = []
+        for a, profile in profiles:
+            if profile is None:
+                rows.append((_get_name_key(a), 0, None, None, None, None, None, None, None, now))
+            else:
+                rows.append((_get_name_key(a), 1, _decode(profile.first_name), _decode(profile.last_name),
+                             _decode(profile.affiliation), _decode(profile.email), _decode(profile.country_code),
+                             _decode(profile.citations), _decode(profile.keywords), now))
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO profiles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._db.commit()
+
+    def report(self):
+        """
+        Log the number of cache hits and misses.
+        """
+        if self.hits + self.misses > 0:
+            log.info("Author profile cache: %s hits, %s misses (%.1f%% hit rate)." %
+                     (self.hits, self.misses, 100.0 * self.hits / (self.hits + self.misses)))
+
+    def close(self):
+        """
+        Close the cache database.
+        """
+        with self._lock:
+            self._db.close()
+
+
+def _get_name_key(author):
+    """
+    Get the cache key of an author, i.e., its canonical name (see entry.get_author_key()).
+    :param author: author
+    :return: canonical name (e.g., u'ferreira da silva|r f')
+    """
+    last_name, first_names = author.key
+    return last_name + u'|' + u' '.join(first_names)
+
+
+def _create_profile(row):
+    """
+    Create a profile (author) from a cache row.
+    :param row: cache row
+    :return: author
+    """
+    first_name, last_name = row[2], row[3]
+    profile = entry.Author(last_name + u', ' + first_name if last_name else first_name)
+    # names are restored as they were found (parsing them again may split them differently)
+    profile.first_name = first_name
+    profile.last_name = last_name
+    profile.key = entry.get_author_key(first_name, last_name)
+    profile.affiliation = row[4]
+    profile.email = row[5]
+    profile.country_code = row[6]
+    profile.citations = row[7]
+    profile.keywords = row[8]
+    return profile
+
+
+def _decode(value):
+    """
+    Convert a value to a unicode string for SQLite (UTF-8 strings are decoded).
+    :param value: value
+    :return: unicode string, or None
+    """
+    if value is None or isinstance(value, unicode):
+        return value
+    return str(value).decode('utf-8')
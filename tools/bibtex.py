@@ -0,0 +1,228 @@
+#
+# Copyright 2016 Rafael Ferreira da Silva
+# http://www.rafaelsilva.com/tools
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+__author__ = "Rafael Ferreira da Silva"
+
+import logging
+import mmap
+import re
+
+log = logging.getLogger(__name__)
+
+# entry header, e.g. '@article{' or '@misc('
+_ENTRY_RE = re.compile(r'@\s*([A-Za-z]+)\s*[{(]')
+# cite key terminated by a comma (entries such as '@author{' have no key)
+_KEY_RE = re.compile(r'\s*([^,\s={}()]*)\s*,')
+# separators between fields: whitespace, commas, and '%' comment lines
+_SEP_RE = re.compile(r'(?:\s+|,|%[^\n]*)*')
+# field name, optionally followed by a value without nested braces (the common case, parsed in a single match)
+_FIELD_RE = re.compile(r'(?:\s+|,|%[^\n]*)*([A-Za-z_][\w\-:.]*)\s*=\s*'
+                       r'(?:{([^{}]*)}|"([^{}"]*)"|([^,})\s{"]+))?')
+_BARE_VALUE_RE = re.compile(r'[^,})\s]*')
+_BRACES_RE = re.compile(r'[{}]')
+_QUOTED_RE = re.compile(r'[{}"]')
+_SKIPPED_TYPES = ('comment', 'preamble', 'string')
+
+
+class TokenizerError(Exception):
+    """A BibTeX entry is malformed."""
+
+
+def tokenize(data):
+    """
+    Scan BibTeX data once and yield its entries. Field values are sliced directly from the data and may span
+    multiple lines (their whitespace is then collapsed). Entries such as '@author{' may not have a cite key.
+    :param data: BibTeX string (or mmap object)
+    :return: generator of (entry type, cite key, list of (field name, field value)) tuples
+    """
+    pos = 0
+    while True:
+        m = _ENTRY_RE.search(data, pos)
+        if not m:
+            return
+        entry_type = m.group(1).lower()
+        pos = m.end()
+
+        try:
+            if entry_type in _SKIPPED_TYPES:
+                pos = _match_brace(data, pos)
+                continue
+            cite_key, fields, pos = _tokenize_entry(data, pos)
+        except TokenizerError as e:
+            log.warning("Skipping malformed entry at offset %s: %s" % (m.start(), e))
+            continue
+
+        yield entry_type, cite_key, fields
+
+
+def tokenize_file(filename):
+    """
+    Tokenize a BibTeX file. The file is memory-mapped, so it is never fully copied into memory.
+    :param filename: BibTeX file
+    :return: generator of (entry type, cite key, list of (field name, field value)) tuples
+    """
+    with open(filename, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files cannot be mapped
+            return
+        try:
+            for token in tokenize(data):
+                yield token
+        finally:
+            data.close()
+
+
+def set_fields(data, cite_key, values):
+    """
+    Set fields of an entry in BibTeX data, leaving the rest of the data unchanged. The values of existing fields are
+    replaced in place, and missing fields are added at the end of the entry.
+    :param data: BibTeX string
+    :param cite_key: cite key of the entry
+    :param values: list of (field name, field value) tuples
+    :return: updated BibTeX string (unchanged if no entry has the cite key)
+    """
+    pos = 0
+    while True:
+        m = _ENTRY_RE.search(data, pos)
+        if not m:
+            return data
+        pos = m.end()
+        if m.group(1).lower() in _SKIPPED_TYPES:
+            pos = _match_brace(data, pos)
+            continue
+        spans = {}
+        try:
+            key, _, pos = _tokenize_entry(data, pos, spans)
+        except TokenizerError:
+            continue
+        if key == cite_key:
+            break
+
+    # edits are applied from the end of the entry, so that the positions of the previous ones are kept
+    edits = []
+    added_fields = ''
+    for name, value in values:
+        value = '{%s}' % value
+        if name.lower() in spans:
+            start, end = spans[name.lower()]
+            edits.append((start, end, value))
+        else:
+            added_fields += '\n\t%s = %s,' % (name, value)
+    if added_fields:
+        # fields are added after the last field (whose trailing comma is optional)
+        last = len(data[:pos - 1].rstrip())
+        if data[last - 1] != ',':
+            added_fields = ',' + added_fields[:-1]
+        edits.append((last, last, added_fields))
+    for start, end, value in sorted(edits, reverse=True):
+        data = data[:start] + value + data[end:]
+    return data
+
+
+def _tokenize_entry(data, pos, spans=None):
+    """
+    Tokenize the body of an entry, starting just after its opening brace.
+    :param data: BibTeX data
+    :param pos: position after the opening brace
+    :param spans: if set, dictionary filled with the (start, end) positions of each field value (with its delimiters)
+    :return: cite key, list of fields, and the position after the closing brace
+    """
+    cite_key = None
+    m = _KEY_RE.match(data, pos)
+    if m:
+        cite_key = m.group(1)
+        pos = m.end()
+
+    fields = []
+    while True:
+        m = _FIELD_RE.match(data, pos)
+        if not m:
+            pos = _SEP_RE.match(data, pos).end()
+            c = data[pos:pos + 1]
+            if c == '}' or c == ')':
+                return cite_key, fields, pos + 1
+            if not c:
+                raise TokenizerError("unexpected end of data")
+            raise TokenizerError("invalid field name")
+
+        name = m.group(1).lower()
+        pos = m.end()
+        index = m.lastindex
+
+        if index > 1:
+            value = m.group(index)
+            if spans is not None:
+                # braces and quotes delimit the values of groups 2 and 3
+                delimiter = 1 if index < 4 else 0
+                spans[name] = (m.start(index) - delimiter, m.end(index) + delimiter)
+        else:
+            # value with nested braces
+            c = data[pos:pos + 1]
+            if c == '{':
+                end = _match_brace(data, pos + 1)
+                value = data[pos + 1:end - 1]
+            elif c == '"':
+                end = _match_quote(data, pos + 1)
+                value = data[pos + 1:end - 1]
+            else:
+                end = _BARE_VALUE_RE.match(data, pos).end()
+                value = data[pos:end]
+            if spans is not None:
+                spans[name] = (pos, end)
+            pos = end
+
+        if '\n' in value:
+            value = ' '.join(value.split())
+        fields.append((name, value))
+
+
+def _match_brace(data, pos):
+    """
+    Find the brace closing a block whose opening brace precedes pos.
+    :param data: BibTeX data
+    :param pos: position after the opening brace
+    :return: position after the closing brace
+    """
+    depth = 1
+    for m in _BRACES_RE.finditer(data, pos):
+        if m.group(0) == '{':
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return m.end()
+    raise TokenizerError("unbalanced braces")
+
+
+def _match_quote(data, pos):
+    """
+    Find the quote closing a value whose opening quote precedes pos. Quotes within braces are ignored.
+    :param data: BibTeX data
+    :param pos: position after the opening quote
+    :return: position after the closing quote
+    """
+    depth = 0
+    for m in _QUOTED_RE.finditer(data, pos):
+        c = m.group(0)
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+        elif depth == 0:
+            return m.end()
+    raise TokenizerError("unterminated quoted value")
@@ -0,0 +1,216 @@
+#
+# Copyright 2016 Rafael Ferreira da Silva
+# http://www.rafaelsilva.com/tools
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+__author__ = "Rafael Ferreira da Silva"
+
+import hashlib
+import logging
+import marshal
+import os
+
+log = logging.getLogger(__name__)
+
+CACHE_SUFFIX = ".cxcache"
+_CACHE_VERSION = "citationxpert-cache-1"
+_HASH_BLOCK_SIZE = 1 << 20
+
+
+def get_cache_filename(filename):
+    """
+    Get the name of the sidecar cache file of a file.
+    :param filename: source file name
+    :return: cache file name
+    """
+    return filename + CACHE_SUFFIX
+
+
+def iter_cached(filename, tokenize):
+    """
+    Yield the tokens of a file from its sidecar cache. If the cache does not exist or is stale, the file is tokenized
+    and the cache is written while the tokens are yielded. A cache is valid if it was created from a file with the
+    same path and size, and either the same modification time or the same content hash.
+    :param filename: source file name
+    :param tokenize: function that tokenizes the source file
+    :return: generator of tokens
+    """
+    cache_filename = get_cache_filename(filename)
+    header = _get_header(filename)
+
+    f = _open_valid_cache(cache_filename, filename, header)
+    if f:
+        log.debug("Loading tokens from cache: %s" % cache_filename)
+        with f:
+            for token in _read_tokens(f):
+                yield token
+        return
+
+    for token in _write_cache(filename, cache_filename, header, tokenize):
+        yield token
+
+
+def update_cache(filename, tokenize):
+    """
+    Make sure the sidecar cache of a file is valid, tokenizing the file if needed.
+    :param filename: source file name
+    :param tokenize: function that tokenizes the source file
+    :return: whether the file has a valid cache
+    """
+    cache_filename = get_cache_filename(filename)
+    header = _get_header(filename)
+
+    f = _open_valid_cache(cache_filename, filename, header)
+    if f:
+        f.close()
+        return True
+
+    if not os.access(os.path.dirname(os.path.abspath(cache_filename)), os.W_OK):
+        return False
+    for _ in _write_cache(filename, cache_filename, header, tokenize):
+        pass
+    return True
+
+
+def dump_tokens(tokens, filename):
+    """
+    Write tokens to a file (without cache header).
+    :param tokens: iterable of tokens
+    :param filename: output file name
+    """
+    with open(filename, 'wb') as f:
+        for token in tokens:
+            marshal.dump(token, f)
+        marshal.dump(None, f)
+
+
+def iter_tokens(filename):
+    """
+    Read tokens written by dump_tokens().
+    :param filename: tokens file name
+    :return: generator of tokens
+    """
+    with open(filename, 'rb') as f:
+        for token in _read_tokens(f):
+            yield token
+
+
+def _read_tokens(f):
+    """
+    Read marshaled tokens up to the end marker.
+    :param f: file object
+    :return: generator of tokens
+    """
+    while True:
+        token = marshal.load(f)
+        if token is None:
+            return
+        yield token
+
+
+def _get_header(filename):
+    """
+    Create the cache header of a file.
+    :param filename: source file name
+    :return: cache header (the content hash is computed lazily)
+    """
+    st = os.stat(filename)
+    return [_CACHE_VERSION, os.path.abspath(filename), st.st_size, st.st_mtime, None]
+
+
+def _get_content_hash(filename):
+    """
+    Compute the MD5 hash of the contents of a file.
+    :param filename: file name
+    :return: hex digest
+    """
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), ''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def _open_valid_cache(cache_filename, filename, header):
+    """
+    Open a cache file if it is valid for a source file.
+    :param cache_filename: cache file name
+    :param filename: source file name
+    :param header: cache header of the source file
+    :return: cache file object positioned after the header, or None if the cache is missing or stale
+    """
+    if not os.path.exists(cache_filename):
+        return None
+
+    f = None
+    try:
+        f = open(cache_filename, 'rb')
+        cached_header = marshal.load(f)
+        if cached_header[:3] == header[:3]:
+            if cached_header[3] == header[3]:
+                return f
+            header[4] = _get_content_hash(filename)
+            if cached_header[4] == header[4]:
+                # same contents, thus only the modification time is updated (the header keeps its size)
+                offset = f.tell()
+                f.close()
+                f = open(cache_filename, 'r+b')
+                marshal.dump(header, f)
+                f.seek(offset)
+                return f
+        log.debug("Ignoring stale cache: %s" % cache_filename)
+    except (EOFError, ValueError, TypeError, IndexError, IOError) as e:
+        log.debug("Ignoring invalid cache '%s': %s" % (cache_filename, e))
+
+    if f:
+        f.close()
+    return None
+
+
+def _write_cache(filename, cache_filename, header, tokenize):
+    """
+    Tokenize a file, writing its tokens to a cache file while yielding them. The cache file is only created if all
+    tokens were written.
+    :param filename: source file name
+    :param cache_filename: cache file name
+    :param header: cache header of the source file
+    :param tokenize: function that tokenizes the source file
+    :return: generator of tokens
+    """
+    tmp_filename = "%s.%s.tmp" % (cache_filename, os.getpid())
+    try:
+        f = open(tmp_filename, 'wb')
+    except IOError as e:
+        log.debug("Unable to write cache '%s': %s" % (cache_filename, e))
+        for token in tokenize(filename):
+            yield token
+        return
+
+    completed = False
+    try:
+        if header[4] is None:
+            header[4] = _get_content_hash(filename)
+        marshal.dump(header, f)
+        for token in tokenize(filename):
+            marshal.dump(token, f)
+            yield token
+        marshal.dump(None, f)
+        completed = True
+    finally:
+        f.close()
+        if completed:
+            os.rename(tmp_filename, cache_filename)
+            log.debug("Wrote cache: %s" % cache_filename)
+        else:
+            os.remove(tmp_filename)
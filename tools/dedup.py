@@ -0,0 +1,252 @@
+#
+# Copyright 2016 Rafael Ferreira da Silva
+# http://www.rafaelsilva.com/tools
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+__author__ = "Rafael Ferreira da Silva"
+
+import logging
+import random
+import re
+
+from tools import utils
+
+log = logging.getLogger(__name__)
+
+_NUM_BINS = 16
+_BIN_SHIFT = 60
+_MAX_HASH = (1 << 64) - 1
+_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+_DENSIFY_OFFSET = 0xC2B2AE3D27D4EB4F
+_LATEX_RE = re.compile(r'\\(?:[A-Za-z]+|[^A-Za-z\s])|[{}]')
+_PUNCTUATION_RE = re.compile(r'[^\w\s]|_', re.UNICODE)
+
+
+def normalize_title(title):
+    """
+    Normalize a title for comparison: LaTeX commands and braces, punctuation, case, and extra whitespace are removed.
+    :param title: entry title
+    :return: normalized title
+    """
+    if not title:
+        return u''
+    if isinstance(title, str):
+        title = title.decode('utf-8', 'ignore')
+    title = _LATEX_RE.sub(u'', title)
+    title = _PUNCTUATION_RE.sub(u' ', title)
+    return u' '.join(title.lower().split())
+
+
+class EntryIndex:
+    def __init__(self, match_year=False, match_author=False, fuzzy=False):
+        """
+        Create a hash index of entries for detecting duplicated entries.
+        :param match_year: whether duplicated entries should also have the same year
+        :param match_author: whether duplicated entries should also have the same first author
+        :param fuzzy: whether entries with similar (but not equal) titles should also be detected as duplicated
+        """
+        self.match_year = match_year
+        self.match_author = match_author
+        self.sources = {}
+        self.num_duplicates = 0
+        self.num_fuzzy_duplicates = 0
+        self.lsh_index = None
+        if fuzzy:
+            self.lsh_index = MinHashIndex()
+
+    def get_key(self, e):
+        """
+        Get the index key of an entry.
+        :param e: entry
+        :return: key built from the normalized title (and year and first author last name, if enabled)
+        """
+        key = normalize_title(e.title)
+        if not self.match_year and not self.match_author:
+            return key
+
+        key = [key]
+        if self.match_year:
+            key.append(str(e.year or '').strip())
+        if self.match_author:
+            last_name = ''
+            if len(e.authors) > 0:
+                last_name = e.authors.authors[0].last_name or e.authors.authors[0].first_name
+            key.append(normalize_title(last_name))
+        return tuple(key)
+
+    def add(self, e, filename=None):
+        """
+        Add an entry to the index.
+        :param e: entry
+        :param filename: file from which the entry was loaded
+        :return: whether the entry was not indexed before (i.e., it is not a duplicate)
+        """
+        key = self.get_key(e)
+        if key in self.sources:
+            self.sources[key].append(filename)
+            self.num_duplicates += 1
+            return False
+
+        if self.lsh_index is not None:
+            similar_key = self._find_similar(key)
+            if similar_key is not None:
+                log.debug("Near-duplicated entry '%s' merged into: '%s'" % (key, similar_key))
+                self.sources[similar_key].append(filename)
+                self.num_duplicates += 1
+                self.num_fuzzy_duplicates += 1
+                return False
+            self.lsh_index.add(key, self._get_title(key))
+
+        self.sources[key] = [filename]
+        return True
+
+    def _find_similar(self, key):
+        """
+        Find an indexed key whose title is similar to the title of the key. Only candidates sharing a locality-sensitive
+        hash bucket are compared.
+        :param key: entry key
+        :return: the similar key, or None if no similar key was found
+        """
+        title = self._get_title(key)
+        if not title:
+            return None
+        for candidate in self.lsh_index.query(title):
+            if isinstance(key, tuple) and candidate[1:] != key[1:]:
+                continue
+            if utils.is_similar(title, self._get_title(candidate)):
+                return candidate
+        return None
+
+    @staticmethod
+    def _get_title(key):
+        if isinstance(key, tuple):
+            return key[0]
+        return key
+
+    def get_duplicates(self):
+        """
+        Get the duplicated entries.
+        :return: dictionary of entry keys to the list of files that contributed the entry
+        """
+        return dict((key, files) for key, files in self.sources.iteritems() if len(files) > 1)
+
+    def report(self):
+        """
+        Log the duplicated entries and the files that contributed them.
+        """
+        for key, files in self.get_duplicates().iteritems():
+            log.debug("Duplicated entry '%s' found in: %s" % (key, ', '.join(str(f) for f in files)))
+        if self.num_duplicates > 0:
+            log.info("Removed %s duplicated entries (%s near-duplicated)." %
+                     (self.num_duplicates, self.num_fuzzy_duplicates))
+
+    def __len__(self):
+        return len(self.sources)
+
+
+class MinHashIndex:
+    def __init__(self, num_bands=12, band_size=4, shingle_size=3):
+        """
+        Create a locality-sensitive hashing (LSH) index of MinHash signatures for finding similar strings. Strings
+        whose character shingles have a Jaccard similarity above ~0.6 are very likely to share a bucket, while
+        unrelated strings rarely do.
+        :param num_bands: number of LSH bands
+        :param band_size: number of signature values per band
+        :param shingle_size: number of characters per shingle
+        """
+        self.num_bands = num_bands
+        self.band_size = band_size
+        self.shingle_size = shingle_size
+        self.buckets = [{} for _ in range(num_bands)]
+        # signatures are computed with one-permutation hashing: each pass hashes all shingles once with a different
+        # salt and keeps the minimum hash value in each of _NUM_BINS bins; bins left empty by short strings are filled
+        # from the next non-empty bin (densification), otherwise unrelated short strings would share buckets
+        num_passes = -(-num_bands * band_size // _NUM_BINS)
+        rnd = random.Random(num_bands * band_size)
+        self._salts = [rnd.getrandbits(64) for _ in range(num_passes)]
+        self._last_bands = (None, None)
+
+    def signature(self, text):
+        """
+        Compute the MinHash signature of a string.
+        :param text: string
+        :return: list of signature values
+        """
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        k = self.shingle_size
+        hashes = set([hash(text[i:i + k]) for i in xrange(max(1, len(text) - k + 1))])
+
+        sig = []
+        for salt in self._salts:
+            bins = [None] * _NUM_BINS
+            for h in hashes:
+                x = ((h ^ salt) * _HASH_MULTIPLIER) & _MAX_HASH
+                b = x >> _BIN_SHIFT
+                if bins[b] is None or x < bins[b]:
+                    bins[b] = x
+            sig.extend(_densify(bins))
+        return sig[:self.num_bands * self.band_size]
+
+    def add(self, item, text):
+        """
+        Add an item to the index.
+        :param item: item (hashable) to be returned by queries
+        :param text: string used to index the item
+        """
+        for band, bucket_key in enumerate(self._get_bands(text)):
+            self.buckets[band].setdefault(bucket_key, []).append(item)
+
+    def query(self, text):
+        """
+        Find candidate items similar to a string.
+        :param text: string
+        :return: list of candidate items (in insertion order)
+        """
+        candidates = []
+        seen = set()
+        for band, bucket_key in enumerate(self._get_bands(text)):
+            for item in self.buckets[band].get(bucket_key, ()):
+                if item not in seen:
+                    seen.add(item)
+                    candidates.append(item)
+        return candidates
+
+    def _get_bands(self, text):
+        # a string is usually queried and then added, so the bands of the last string are reused
+        if self._last_bands[0] == text:
+            return self._last_bands[1]
+        sig = self.signature(text)
+        r = self.band_size
+        bands = [tuple(sig[i:i + r]) for i in xrange(0, len(sig), r)]
+        self._last_bands = (text, bands)
+        return bands
+
+
+def _densify(bins):
+    """
+    Fill the empty bins of a one-permutation MinHash pass with the value of the next non-empty bin (circularly),
+    offset by their distance to it, so that empty bins are as discriminative as the non-empty ones.
+    :param bins: minimum hash value of each bin (None for empty bins), at least one bin is not empty
+    :return: list of bin values
+    """
+    n = len(bins)
+    dense = list(bins)
+    for i in xrange(n):
+        if bins[i] is None:
+            distance = 1
+            while bins[(i + distance) % n] is None:
+                distance += 1
+            dense[i] = (bins[(i + distance) % n] + distance * _DENSIFY_OFFSET) & _MAX_HASH
+    return dense
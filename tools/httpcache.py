@@ -0,0 +1,211 @@
+#
+# Copyright 2016 Rafael Ferreira da Silva
+# http://www.rafaelsilva.com/tools
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+__author__ = "Rafael Ferreira da Silva"
+
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import urllib
+import urlparse
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.citationxpert', 'cache')
+DEFAULT_MAX_SIZE = 512 << 20
+
+_HOUR = 3600
+_DAY = 24 * _HOUR
+
+# time to live of the responses of each class of URLs (the first matching pattern applies)
+DEFAULT_TTLS = (
+    # settings pages set the session cookies, thus they are never cached
+    (re.compile(r'/scholar_set'), 0),
+    # BibTeX exports of an article rarely change
+    (re.compile(r'/scholar\.bib|output=citation'), 30 * _DAY),
+    # author profiles
+    (re.compile(r'/citations\?'), 7 * _DAY),
+    # search and citations result pages
+    (re.compile(r'/scholar\?'), _DAY),
+)
+
+# query arguments that change across sessions without changing the response (e.g., signatures)
+_VOLATILE_ARGS = ('scisig',)
+
+
+def normalize_url(url):
+    """
+    Normalize a URL, so that equivalent URLs have the same cache key: the scheme and host are lowercased, the query
+    arguments are sorted, and volatile arguments are removed.
+    :param url: URL
+    :return: normalized URL
+    """
+    parts = urlparse.urlsplit(url)
+    args = [(k, v) for k, v in urlparse.parse_qsl(parts.query, keep_blank_values=True) if k not in _VOLATILE_ARGS]
+    query = urllib.urlencode(sorted(args))
+    return urlparse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', query, ''))
+
+
+class ResponseCache(object):
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE, ttls=DEFAULT_TTLS):
+        """
+        Create a disk cache of HTTP responses, content-addressed by the SHA-1 hash of the normalized URL. Responses
+        expire according to the time to live of their URL class, and the least recently used responses are evicted
+        once the cache exceeds its maximum size. The cache is thread-safe.
+        :param cache_dir: cache directory
+        :param max_size: maximum size of the cache in bytes
+        :param ttls: list of (URL pattern, time to live in seconds)
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.ttls = ttls
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._lock = threading.Lock()
+
+    def get_ttl(self, url):
+        """
+        Get the time to live of the response of a URL.
+        :param url: URL
+        :return: time to live in seconds (0 if the response is not cached)
+        """
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+        return _DAY
+
+    def get(self, url):
+        """
+        Get the cached response of a URL.
+        :param url: URL
+        :return: response data, or None if the response is not cached or has expired
+        """
+        ttl = self.get_ttl(url)
+        if ttl <= 0:
+            return None
+
+        filename = self._get_filename(url)
+        now = time.time()
+        try:
+            st = os.stat(filename)
+            if now - st.st_mtime > ttl:
+                log.debug("Expired cached response: %s" % url)
+                self._count(hit=False)
+                return None
+            with open(filename, 'rb') as f:
+                data = f.read()
+            # the access time tracks the use of the response for evicting the least recently used ones
+            os.utime(filename, (now, st.st_mtime))
+        except (IOError, OSError):
+            self._count(hit=False)
+            return None
+
+        self._count(hit=True)
+        return data
+
+    def put(self, url, data):
+        """
+        Store the response of a URL.
+        :param url: URL
+        :param data: response data
+        """
+        if data is None or self.get_ttl(url) <= 0:
+            return
+
+        filename = self._get_filename(url)
+        tmp_filename = "%s.%s.%s.tmp" % (filename, os.getpid(), threading.current_thread().ident)
+        try:
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            old_size = os.path.getsize(filename) if os.path.exists(filename) else 0
+            with open(tmp_filename, 'wb') as f:
+                f.write(data)
+            os.rename(tmp_filename, filename)
+        except (IOError, OSError) as e:
+            log.debug("Unable to cache response of '%s': %s" % (url, e))
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._get_cache_size()
+            else:
+                self._size += len(data) - old_size
+            if self._size > self.max_size:
+                self._evict()
+
+    def report(self):
+        """
+        Log the number of cache hits and misses.
+        """
+        if self.hits + self.misses > 0:
+            log.info("HTTP cache: %s hits, %s misses (%.1f%% hit rate)." %
+                     (self.hits, self.misses, 100.0 * self.hits / (self.hits + self.misses)))
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _get_filename(self, url):
+        key = hashlib.sha1(normalize_url(url)).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _iter_files(self):
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if not filename.endswith('.tmp'):
+                    yield os.path.join(dirpath, filename)
+
+    def _get_cache_size(self):
+        size = 0
+        for filename in self._iter_files():
+            try:
+                size += os.path.getsize(filename)
+            except OSError:
+                pass
+        return size
+
+    def _evict(self):
+        """
+        Remove the least recently used responses until the cache uses at most 90% of its maximum size.
+        """
+        files = []
+        for filename in self._iter_files():
+            try:
+                st = os.stat(filename)
+                files.append((st.st_atime, st.st_size, filename))
+            except OSError:
+                pass
+        files.sort()
+
+        target_size = self.max_size * 0.9
+        num_evicted = 0
+        for _, size, filename in files:
+            if self._size <= target_size:
+                break
+            try:
+                os.remove(filename)
+                self._size -= size
+                num_evicted += 1
+            except OSError:
+                pass
+        log.debug("Evicted %s cached responses." % num_evicted)
@@ -0,0 +1,138 @@
+#
+# Copyright 2016 Rafael Ferreira da Silva
+# http://www.rafaelsilva.com/tools
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+__author__ = "Rafael Ferreira da Silva"
+
+import json
+import logging
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+JOURNAL_SUFFIX = ".journal"
+
+
+class CrawlJournal(object):
+    def __init__(self, filename, resume=False):
+        """
+        Create an append-only journal of a citations crawl, in which each completed page of citations is recorded
+        (one JSON record per line) as soon as it is fetched. A crawl resumed from its journal only fetches the pages
+        that were not completed.
+        :param filename: journal file name
+        :param resume: whether the records of an existing journal should be loaded (otherwise it is overwritten)
+        """
+        self.filename = filename
+        self.publications = {}
+        self.completed_pages = {}
+        # citations of the pages completed in a previous crawl (only kept in memory until they are popped)
+        self._loaded_pages = {}
+        self._lock = threading.Lock()
+
+        if resume and os.path.exists(filename):
+            self._load()
+            log.info("Resuming crawl from journal '%s' (%s completed pages)." %
+                     (filename, sum(len(starts) for starts in self.completed_pages.itervalues())))
+        self._file = open(filename, 'a' if resume else 'w')
+
+    def get_publication(self, title):
+        """
+        Get the recorded publication of a title.
+        :param title: publication title
+        :return: publication record (dictionary), or None if the publication was not recorded
+        """
+        return self.publications.get(title)
+
+    def add_publication(self, title, publication):
+        """
+        Record the publication found for a title.
+        :param title: publication title
+        :param publication: publication record (dictionary)
+        """
+        self.publications[title] = publication
+        self._write({'type': 'publication', 'title': title, 'publication': publication})
+
+    def get_completed_pages(self, title):
+        """
+        Get the completed pages of citations of a publication.
+        :param title: publication title
+        :return: set of the indexes of the first citation of each completed page
+        """
+        return self.completed_pages.setdefault(title, set())
+
+    def pop_page(self, title, start):
+        """
+        Get (and release from memory) the citations of a page completed in a previous crawl.
+        :param title: publication title
+        :param start: index of the first citation of the page
+        :return: list of citations of the page, or None if the page was not completed in a previous crawl
+        """
+        return self._loaded_pages.pop((title, start), None)
+
+    def add_page(self, title, start, citations):
+        """
+        Record a completed page of citations of a publication. The citations are not kept in memory.
+        :param title: publication title
+        :param start: index of the first citation of the page
+        :param citations: list of citations of the page
+        """
+        self.get_completed_pages(title).add(start)
+        self._write({'type': 'page', 'title': title, 'start': start, 'citations': citations})
+
+    def close(self, remove=False):
+        """
+        Close the journal.
+        :param remove: whether the journal file should be removed (i.e., the crawl was completed)
+        """
+        self._file.close()
+        if remove:
+            os.remove(self.filename)
+
+    def _write(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def _load(self):
+        with open(self.filename) as f:
+            for line in f:
+                try:
+                    record = _encode(json.loads(line))
+                except ValueError:
+                    # the last record may be incomplete if the crawl was interrupted while writing it
+                    log.debug("Ignoring incomplete journal record: %s" % line.strip())
+                    continue
+                if record['type'] == 'publication':
+                    self.publications[record['title']] = record['publication']
+                elif record['type'] == 'page':
+                    self.get_completed_pages(record['title']).add(record['start'])
+                    self._loaded_pages[(record['title'], record['start'])] = record['citations']
+
+
+def _encode(value):
+    """
+    Convert the unicode strings of a decoded JSON value to UTF-8 strings, as they were before encoding.
+    :param value: decoded JSON value
+    :return: converted value
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict):
+        return dict((_encode(k), _encode(v)) for k, v in value.iteritems())
+    return value
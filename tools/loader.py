@@ -16,121 +16,123 @@
 #
 __author__ = "Rafael Ferreira da Silva"
 
+import collections
+import itertools
 import logging
+import multiprocessing
+import os
 import re
+import tempfile
 
 from operations import entry
+from tools import bibtex
+from tools import cache
+from tools import dedup
 from tools import utils
 
 log = logging.getLogger(__name__)
 
+_MARKUP_RE = re.compile('{|"|}')
 
-def load_entries(filename):
-    """
 
-    :param filename:
-    :return:
+class LoaderConf:
+    """Helper class for global loader settings."""
+
+    # If set, entries with similar titles (e.g., preprint and journal versions of a paper) are merged as duplicates
+    FUZZY_MERGE = False
+
+    # If set, parsed files are cached in sidecar files (see tools.cache) and reused while the files are unchanged
+    PARSE_CACHE = True
+
+    # Number of worker processes used to parse multiple files
+    JOBS = 1
+
+
+def iter_entries(filename):
+    """
+    Lazily parse a citations file, yielding one entry at a time. The file is scanned once by the BibTeX tokenizer.
+    :param filename: citations file
+    :return: generator of entries
     """
     log.debug("Parsing file: %s" % filename)
 
-    entries = []
+    for bib_type, cite_key, fields in _tokenize_file(filename):
+        yield _create_entry(bib_type, cite_key, fields)
 
-    with open(filename) as f:
-        for line in f:
-            line = line.strip()
-            if line.startswith("@"):
-                buffer_line = ""
 
-            buffer_line += line + "\n"
+def load_entries(filename):
+    """
+    Load all entries from a citations file.
+    :param filename: citations file
+    :return: list of entries
+    """
+    return list(iter_entries(filename))
 
-            if line.startswith("}"):
-                entries.append(parse_bib_entry(buffer_line))
 
-    return entries
+def iter_publication_entries(list_of_files):
+    """
+    Yield the main publication entries from a list of files.
+    :param list_of_files: list of citation files
+    :return: generator of main publication entries
+    """
+    for filename, e in _iter_files_entries(list_of_files):
+        if e.main_publication:
+            yield e
 
 
-def load_list_of_entries(list_of_files):
+def iter_citation_entries(list_of_files, index=None, fuzzy=None):
+    """
+    Yield the citation entries (i.e., not main publications) from a list of files. Duplicated entries are skipped
+    using a hash index of normalized titles, thus only the index keys are kept in memory.
+    :param list_of_files: list of citation files
+    :param index: entry index used to detect duplicated entries (a title-only index is used if not provided)
+    :param fuzzy: whether entries with similar titles are also merged (defaults to LoaderConf.FUZZY_MERGE)
+    :return: generator of citation entries
+    """
+    if index is None:
+        index = _create_index(fuzzy)
+
+    for filename, e in _iter_files_entries(list_of_files):
+        if not e.main_publication and index.add(e, filename):
+            yield e
+
+    index.report()
+
+
+def load_list_of_entries(list_of_files, index=None, fuzzy=None):
     """
     Load entries from list of files. The method also seeks for duplicated entries and remove them.
     :param list_of_files: list of citation files
+    :param index: entry index used to detect duplicated entries (a title-only index is used if not provided)
+    :param fuzzy: whether entries with similar titles are also merged (defaults to LoaderConf.FUZZY_MERGE)
     :return: list of entries from all citation files
     """
     publication_entries = []
     entries = []
-    titles = []
 
-    for filename in list_of_files:
-        entries_list = load_entries(filename)
+    if index is None:
+        index = _create_index(fuzzy)
 
-        for e in entries_list:
-            if e.main_publication:
-                publication_entries.append(e)
-            elif e.title not in titles:
-                titles.append(e.title)
-                entries.append(e)
+    for filename, e in _iter_files_entries(list_of_files):
+        if e.main_publication:
+            publication_entries.append(e)
+        elif index.add(e, filename):
+            entries.append(e)
 
+    index.report()
     return publication_entries, entries
 
 
 def parse_bib_entry(data, num_citations=None, url=None):
     """
-
-    :param data:
-    :param num_citations:
-    :param url:
-    :return:
+    Parse a single BibTeX entry.
+    :param data: BibTeX string
+    :param num_citations: number of citations of the entry
+    :param url: entry url
+    :return: the first entry found in data
     """
-    lines = data.split('\n')
-    if not num_citations:
-        num_citations = 0
-    new_entry = {
-        'citations': num_citations,
-        'url': url
-    }
-    values = {}
-
-    for line in lines:
-        line = line.strip()
-
-        if line.startswith("%") or len(line) == 0:
-            continue
-
-        if line.startswith("@"):
-            # bib type and key
-            index = re.search("{|\(", line).start()
-            bib_type = _parse_bib_type(line[1:index].strip())
-            key = line[index + 1:line.index(',')].strip()
-            new_entry['bib_type'] = bib_type
-            new_entry['cite_key'] = key
-
-        else:
-            # other fields
-            if line.startswith("}"):
-                for key in values:
-                    if values[key]:
-                        new_entry[key] = values[key]
-                    else:
-                        log.debug("[%s] Ignoring entry '%s': value is empty." % (new_entry['cite_key'], key))
-                return _add_entry(new_entry)
-
-            else:
-                s = re.split("=\s*\"|=\s*\{|=\s*", line)
-                key = s[0].strip().lower()
-                if len(key) == 0:
-                    continue
-                value = s[1].strip()
-                if key == "howpublished":
-                    value = value.replace("\\url{", "")
-                    value = value.replace("}}", "")
-
-                if value.startswith("{") or value.startswith("\""):
-                    value = value[1:len(value)]
-                if value.endswith("}") or value.endswith("\"") or value.endswith(","):
-                    value = value[0:len(value) - 1]
-                if value.endswith("},") or value.endswith("\","):
-                    value = value[0:len(value) - 2]
-                value = re.sub("{|\"|}", "", value)
-                values[key] = value
+    for bib_type, cite_key, fields in bibtex.tokenize(data):
+        return _create_entry(bib_type, cite_key, fields, num_citations, url)
 
 
 def load_authors(list_of_files):
@@ -140,37 +142,171 @@ def load_authors(list_of_files):
     :return: list of authors
     """
     authors = []
-    author = {}
+    authors_keys = set()
 
     for authors_file in list_of_files:
-        with open(authors_file) as f:
-            for line in f:
-                line = line.strip()
-
-                if line.startswith("@author"):
-                    author = {}
-
-                elif line.startswith("}"):
-                    author_obj = _create_author(author)
-                    if author_obj not in authors:
-                        authors.append(author_obj)
-
-                elif len(line) > 0:
-                    s = re.split("=\s*\"|=\s*\{|=\s*", line)
-                    key = s[0].strip().lower()
-                    value = s[1].strip()
-                    if value.startswith("{") or value.startswith("\""):
-                        value = value[1:len(value)]
-                    if value.endswith("}") or value.endswith("\"") or value.endswith(","):
-                        value = value[0:len(value) - 1]
-                    if value.endswith("},") or value.endswith("\","):
-                        value = value[0:len(value) - 2]
-                    value = re.sub("{|\"|}", "", value)
-                    author[key] = value
+        for bib_type, cite_key, fields in _tokenize_file(authors_file):
+            author = {}
+            for key, value in fields:
+                author[key] = _clean_value(key, value)
+
+            author_obj = _create_author(author)
+            if author_obj.key not in authors_keys:
+                authors_keys.add(author_obj.key)
+                authors.append(author_obj)
 
     return authors
 
 
+def _iter_files_entries(list_of_files, jobs=None):
+    """
+    Yield the entries of a list of files, in order. If more than one job is requested, files are tokenized in worker
+    processes, and only a bounded number of tokenized files are kept waiting to be consumed.
+    :param list_of_files: list of citation files
+    :param jobs: number of worker processes (defaults to LoaderConf.JOBS)
+    :return: generator of (file name, entry) tuples
+    """
+    if jobs is None:
+        jobs = LoaderConf.JOBS
+    jobs = min(jobs, len(list_of_files))
+
+    if jobs <= 1:
+        for filename in list_of_files:
+            for e in iter_entries(filename):
+                yield filename, e
+        return
+
+    pool = multiprocessing.Pool(jobs)
+    pending = collections.deque()
+    try:
+        files = iter(list_of_files)
+
+        for filename in itertools.islice(files, 2 * jobs):
+            pending.append(_submit_tokens(pool, filename))
+
+        while pending:
+            filename, tokens_filename, result = pending[0]
+            tokens_written = result.get()
+            pending.popleft()
+            for next_filename in itertools.islice(files, 1):
+                pending.append(_submit_tokens(pool, next_filename))
+
+            try:
+                if tokens_written:
+                    log.debug("Parsing file: %s" % filename)
+                    for bib_type, cite_key, fields in cache.iter_tokens(tokens_filename):
+                        yield filename, _create_entry(bib_type, cite_key, fields)
+                else:
+                    for e in iter_entries(filename):
+                        yield filename, e
+            finally:
+                os.remove(tokens_filename)
+
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        # files still queued if the consumer stopped early (or failed), including files being tokenized when the
+        # workers were terminated
+        for _, tokens_filename, _ in pending:
+            if os.path.exists(tokens_filename):
+                os.remove(tokens_filename)
+
+
+def _submit_tokens(pool, filename):
+    """
+    Submit the tokenization of a BibTeX file to a worker process. The temporary tokens file is created by the main
+    process, so that it can be removed even if the worker is terminated.
+    :param pool: pool of worker processes
+    :param filename: BibTeX file
+    :return: (file name, temporary tokens file name, asynchronous result of _prepare_tokens()) tuple
+    """
+    fd, tokens_filename = tempfile.mkstemp(suffix='.tokens', prefix='citationxpert-')
+    os.close(fd)
+    return filename, tokens_filename, pool.apply_async(_prepare_tokens,
+                                                       (filename, tokens_filename, LoaderConf.PARSE_CACHE))
+
+
+def _prepare_tokens(filename, tokens_filename, parse_cache):
+    """
+    Tokenize a BibTeX file in a worker process. Tokens are exchanged through files, which are faster to load than
+    pickled results and let the main process stream them.
+    :param filename: BibTeX file
+    :param tokens_filename: temporary tokens file name
+    :param parse_cache: whether the parse cache should be used
+    :return: whether the tokens were written to the tokens file (otherwise, they should be read from the parse cache)
+    """
+    if parse_cache and cache.update_cache(filename, bibtex.tokenize_file):
+        return False
+
+    cache.dump_tokens(bibtex.tokenize_file(filename), tokens_filename)
+    return True
+
+
+def _tokenize_file(filename):
+    """
+    Tokenize a BibTeX file, using its parse cache if enabled.
+    :param filename: BibTeX file
+    :return: generator of (entry type, cite key, list of (field name, field value)) tuples
+    """
+    if LoaderConf.PARSE_CACHE:
+        return cache.iter_cached(filename, bibtex.tokenize_file)
+    return bibtex.tokenize_file(filename)
+
+
+def _create_index(fuzzy=None):
+    """
+    Create an index for detecting duplicated entries.
+    :param fuzzy: whether entries with similar titles are also merged (defaults to LoaderConf.FUZZY_MERGE)
+    :return: entry index
+    """
+    if fuzzy is None:
+        fuzzy = LoaderConf.FUZZY_MERGE
+    return dedup.EntryIndex(fuzzy=fuzzy)
+
+
+def _create_entry(bib_type, cite_key, fields, num_citations=None, url=None):
+    """
+    Create an entry object from the tokens of a BibTeX entry.
+    :param bib_type: entry type name
+    :param cite_key: entry cite key
+    :param fields: list of (field name, field value) tuples
+    :param num_citations: number of citations of the entry
+    :param url: entry url
+    :return: an entry object
+    """
+    if not num_citations:
+        num_citations = 0
+    new_entry = {
+        'bib_type': _parse_bib_type(bib_type),
+        'cite_key': cite_key,
+        'citations': num_citations,
+        'url': url
+    }
+
+    for key, value in fields:
+        value = _clean_value(key, value)
+        if value:
+            new_entry[key] = value
+        else:
+            log.debug("[%s] Ignoring entry '%s': value is empty." % (cite_key, key))
+
+    return _add_entry(new_entry)
+
+
+def _clean_value(key, value):
+    """
+    Remove BibTeX markup (braces, quotes, and urls in 'howpublished') from a field value.
+    :param key: field name
+    :param value: raw field value
+    :return: cleaned value
+    """
+    value = value.strip()
+    if key == "howpublished":
+        value = value.replace("\\url{", "")
+    return _MARKUP_RE.sub("", value)
+
+
 def _create_author(author_dict):
     """
 
@@ -252,7 +388,7 @@ def _add_entry(new_entry):
         number=_get_value("number", new_entry),
         organization=_get_value("organization", new_entry),
         pages=_get_value("pages", new_entry),
-        publisher=_get_value("published", new_entry),
+        publisher=_get_value("publisher", new_entry),
         school=_get_value("school", new_entry),
         series=_get_value("series", new_entry),
         title=_get_value("title", new_entry),
@@ -262,6 +398,7 @@ def _add_entry(new_entry):
         year=_get_value("year", new_entry),
         main_publication=_get_value("main_publication", new_entry),
         citations=_get_value("citations", new_entry),
+        cluster_id=_get_value("cluster_id", new_entry),
         op_self=_get_value("op_self", new_entry),
         h_index=_get_value("h_index", new_entry),
     )
@@ -0,0 +1,208 @@
+#
+# Copyright 2016 Rafael Ferreira da Silva
+# http://www.rafaelsilva.com/tools
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+__author__ = "Rafael Ferreira da Silva"
+
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from externals import scholar
+from optparse import OptionParser
+from operations import author
+from operations import citations
+from operations import manifest
+from tools import authorcache
+from tools import httpcache
+from tools import ratelimit
+from tools import standin
+from tools import utils
+
+log = logging.getLogger(__name__)
+
+SCENARIOS = ('citations', 'update', 'manifest', 'author')
+
+# kinds of requests of result pages (i.e., not settings or BibTeX exports)
+_PAGE_KINDS = ('search', 'citations', 'authors')
+
+_TITLE = "Synthetic publication for load testing"
+
+
+class LoadTestResult(object):
+    __slots__ = ('scenario', 'wall_time', 'stats')
+
+    def __init__(self, scenario, wall_time, stats):
+        """
+        Create the result of a load test scenario.
+        :param scenario: scenario name
+        :param wall_time: wall time of the scenario in seconds
+        :param stats: counters of the requests served by the stand-in server (see StandInServer.get_stats())
+        """
+        self.scenario = scenario
+        self.wall_time = wall_time
+        self.stats = stats
+
+    @property
+    def num_requests(self):
+        return sum(self.stats.get(k, 0) for k in ('settings', 'search', 'citations', 'bib', 'authors', 'other'))
+
+    @property
+    def num_pages(self):
+        return sum(self.stats.get(k, 0) for k in _PAGE_KINDS)
+
+    def __str__(self):
+        wall_time = max(self.wall_time, 1e-6)
+        return "%-10s %8.2f %9s %9.1f %7s %8.1f %6s %6s %5s %5s" % (
+            self.scenario, self.wall_time, self.num_requests, self.num_requests / wall_time, self.num_pages,
+            self.num_pages / wall_time, self.stats.get('bib', 0), self.stats.get('connections', 0),
+            self.stats.get('errors', 0), self.stats.get('throttled', 0))
+
+
+def run(server, scenarios=SCENARIOS, num_new_citations=20, num_publications=4, work_dir=None):
+    """
+    Run load test scenarios against a started stand-in server, measuring the wall time and the requests served for
+    full crawls and analyses. Crawls use the current global settings (e.g., CitationsConf.WORKERS and
+    ScholarConf.RATE_LIMITER). Scenarios are run in order, and later scenarios use the output of earlier ones:
+      - 'citations': crawl the citations of a publication
+      - 'update': fetch the new citations of the crawled publication, once num_new_citations were added
+      - 'manifest': crawl the citations of num_publications publications listed in a manifest
+      - 'author': analyze the authors of the crawled citations, querying for their profiles
+    :param server: started stand-in server
+    :param scenarios: list of scenario names
+    :param num_new_citations: number of citations added before the 'update' scenario
+    :param num_publications: number of publications of the 'manifest' scenario
+    :param work_dir: directory of the output files (by default, a temporary directory removed afterwards)
+    :return: list of scenario results
+    """
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            raise ValueError("Unknown load test scenario: %s" % scenario)
+
+    scholar.ScholarConf.SITE_OVERRIDE = server.url
+    own_work_dir = work_dir is None
+    if own_work_dir:
+        work_dir = tempfile.mkdtemp(prefix='citationxpert-loadtest-')
+    citations_filename = os.path.join(work_dir, 'citations.bib')
+
+    results = []
+    try:
+        for scenario in scenarios:
+            log.info("Running load test scenario: %s" % scenario)
+            server.reset_stats()
+            start_time = time.time()
+
+            if scenario == 'citations':
+                with open(citations_filename, 'w') as output:
+                    citations.process([_TITLE], output=output)
+
+            elif scenario == 'update':
+                _check_citations_file(citations_filename, scenario)
+                server.num_citations += num_new_citations
+                citations.update(citations_filename)
+
+            elif scenario == 'manifest':
+                manifest_filename = os.path.join(work_dir, 'manifest.tsv')
+                with open(manifest_filename, 'w') as f:
+                    for i in range(num_publications):
+                        f.write("%s %s\t%s\n" % (_TITLE, i, os.path.join(work_dir, 'manifest', '%s.bib' % i)))
+                manifest.process(manifest_filename)
+
+            elif scenario == 'author':
+                _check_citations_file(citations_filename, scenario)
+                with open(os.path.join(work_dir, 'citations-authors.bib'), 'w') as output:
+                    author.process([citations_filename], output=output)
+
+            results.append(LoadTestResult(scenario, time.time() - start_time, server.get_stats()))
+    finally:
+        scholar.ScholarConf.SITE_OVERRIDE = None
+        if own_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def _check_citations_file(citations_filename, scenario):
+    if not os.path.exists(citations_filename):
+        raise ValueError("The '%s' scenario requires the 'citations' scenario to be run first." % scenario)
+
+
+def main():
+    parser = OptionParser(usage="usage: python -m tools.loadtest [OPTIONS]",
+                          description="Measure the throughput of full crawls and analyses against a local stand-in "
+                                      "of Google Scholar.")
+    parser.add_option("-s", "--scenario", dest="scenarios", action="append", type="choice", choices=SCENARIOS,
+                      default=None, help="Scenario to run, can be used multiple times (default: all, in order: %s)"
+                                         % ", ".join(SCENARIOS))
+    parser.add_option("--citations", dest="num_citations", action="store", type="int", default=200,
+                      help="Number of citations of the crawled publications (default: 200)")
+    parser.add_option("--new-citations", dest="num_new_citations", action="store", type="int", default=20,
+                      help="Number of citations added before the 'update' scenario (default: 20)")
+    parser.add_option("--publications", dest="num_publications", action="store", type="int", default=4,
+                      help="Number of publications of the 'manifest' scenario (default: 4)")
+    parser.add_option("--latency", dest="latency", action="store", type="float", default=0.05,
+                      help="Number of seconds waited by the server before each response (default: 0.05)")
+    parser.add_option("--error-rate", dest="error_rate", action="store", type="float", default=0.0,
+                      help="Fraction of requests answered with a server error (default: 0)")
+    parser.add_option("--throttle", dest="throttle_rate", action="store", type="float", default=None,
+                      help="Maximum number of requests per second served before throttling (default: no limit)")
+    parser.add_option("-w", "--workers", dest="workers", action="store", type="int", default=4,
+                      help="Number of citation pages fetched concurrently (default: 4)")
+    parser.add_option("--export-workers", dest="export_workers", action="store", type="int", default=4,
+                      help="Number of BibTeX exports of a citation page fetched concurrently (default: 4)")
+    parser.add_option("--manifest-workers", dest="manifest_workers", action="store", type="int", default=2,
+                      help="Number of manifest publications crawled concurrently (default: 2)")
+    parser.add_option("--rate", dest="rate", action="store", type="float", default=None,
+                      help="Maximum number of requests per second sent by the client (default: no limit)")
+    parser.add_option("--burst", dest="burst", action="store", type="int", default=4,
+                      help="Maximum number of requests sent at once, above the request rate (default: 4)")
+    parser.add_option("--cache-dir", dest="cache_dir", action="store", type="string", default=None,
+                      help="Directory of a cache of responses used by the crawls (default: no cache)")
+    parser.add_option("--author-cache", dest="author_cache", action="store", type="string", default=None,
+                      help="Database of a cache of author profiles used by the 'author' scenario (default: no cache)")
+    parser.add_option("-o", "--output-dir", dest="work_dir", action="store", type="string", default=None,
+                      help="Directory of the output files (default: a temporary directory)")
+    parser.add_option("-v", "--verbose", dest="verbose", action="store_true", default=False,
+                      help="Show progress messages")
+    options, args = parser.parse_args()
+
+    utils.configure_logging(level=logging.INFO if options.verbose else logging.WARNING)
+    citations.CitationsConf.WORKERS = options.workers
+    scholar.ScholarConf.CITATION_WORKERS = options.export_workers
+    manifest.ManifestConf.WORKERS = options.manifest_workers
+    manifest.ManifestConf.RETRY_DELAY = 1
+    scholar.ScholarConf.RATE_LIMITER = ratelimit.TokenBucket(options.rate, options.burst) if options.rate else None
+    scholar.ScholarConf.RESPONSE_CACHE = httpcache.ResponseCache(options.cache_dir) if options.cache_dir else None
+    author.AuthorConf.PROFILE_CACHE = authorcache.AuthorProfileCache(options.author_cache) \
+        if options.author_cache else None
+
+    server = standin.StandInServer(num_citations=options.num_citations, latency=options.latency,
+                                   error_rate=options.error_rate, throttle_rate=options.throttle_rate)
+    server.start()
+    try:
+        results = run(server, scenarios=options.scenarios or SCENARIOS, num_new_citations=options.num_new_citations,
+                      num_publications=options.num_publications, work_dir=options.work_dir)
+    finally:
+        server.stop()
+
+    print "%-10s %8s %9s %9s %7s %8s %6s %6s %5s %5s" % ('scenario', 'wall(s)', 'requests', 'req/s', 'pages',
+                                                          'pages/s', 'bib', 'conns', 'errs', 'thrtl')
+    for result in results:
+        print result
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#
+# Copyright 2016 Rafael Ferreira da Silva
+# http://www.rafaelsilva.com/tools
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+__author__ = "Rafael Ferreira da Silva"
+
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst=1):
+        """
+        Create a token bucket rate limiter, shared by any number of threads. Tokens are added at a constant rate up
+        to the bucket capacity (burst), and each request takes one token.
+        :param rate: sustained number of requests per second
+        :param burst: maximum number of requests that can be sent at once after an idle period
+        """
+        if rate <= 0:
+            raise ValueError("The request rate must be positive: %s" % rate)
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        self._timestamp = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token from the bucket, waiting until one is available. Tokens are reserved in the order acquire() is
+        called, so waiting threads are served in turn.
+        :return: number of seconds waited
+        """
+        with self._lock:
+            now = time.time()
+            elapsed = max(0.0, now - self._timestamp)
+            self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+            self._timestamp = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+        if wait > 0:
+            log.debug("Rate limit reached, waiting %.2f seconds." % wait)
+            time.sleep(wait)
+        return wait
+
+    def try_acquire(self):
+        """
+        Take a token from the bucket if one is available, without waiting.
+        :return: whether a token was taken
+        """
+        with self._lock:
+            now = time.time()
+            elapsed = max(0.0, now - self._timestamp)
+            self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+            self._timestamp = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
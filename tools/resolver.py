@@ -0,0 +1,182 @@
+#
+# Copyright 2016 Rafael Ferreira da Silva
+# http://www.rafaelsilva.com/tools
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+__author__ = "Rafael Ferreira da Silva"
+
+import logging
+
+from tools import utils
+
+log = logging.getLogger(__name__)
+
+# similarity threshold of last names spelled differently (e.g., 'silva' and 'sylva')
+NAME_SIMILARITY_THRESHOLD = 0.8
+
+_SOUNDEX_CODES = dict((c, unicode(code)) for code, letters in enumerate(
+    [u'aeiouyhw', u'bfpv', u'cgjkqsxz', u'dt', u'l', u'mn', u'r']) for c in letters)
+
+
+class AuthorResolver:
+    def __init__(self):
+        """
+        Create an index resolving author mentions (e.g., 'Silva, R. F.', 'Rafael Ferreira da Silva', and 'Silva,
+        Rafael') into authors. Mentions are indexed by their canonical keys (see entry.get_author_key()), so repeated
+        mentions cost a hash lookup. New mentions are only compared to the authors sharing their block, i.e., the
+        phonetic code of their last name and their first initial. A mention is resolved into an author whose last
+        name matches (equal, a suffix, or similar) and whose first names match (equal or initials); mentions matching
+        several authors (e.g., 'Silva, R.' once 'Rafael Silva' and 'Roberto Silva' are known) are ambiguous, and thus
+        kept apart.
+        """
+        # author ID of each mention key
+        self.ids = {}
+        # merged (most complete) last and first names of each author
+        self.names = {}
+        # author IDs of each block
+        self.blocks = {}
+        self.num_mentions = 0
+        self.num_merged = 0
+        self.num_ambiguous = 0
+
+    def resolve(self, author):
+        """
+        Resolve an author mention.
+        :param author: author
+        :return: author ID, i.e., the canonical name of the first mention of the author (e.g., u'silva|r f')
+        """
+        self.num_mentions += 1
+        author_id = self.ids.get(author.key)
+        if author_id is not None:
+            return author_id
+
+        last_name, first_names = author.key
+        block = self.blocks.setdefault(_get_block_key(last_name, first_names), []) if last_name else None
+
+        candidates = []
+        if block:
+            last_tokens = tuple(last_name.split())
+            for candidate_id in block:
+                candidate_last_tokens, candidate_first_names = self.names[candidate_id]
+                if _first_names_match(first_names, candidate_first_names) and \
+                        _last_names_match(last_tokens, candidate_last_tokens):
+                    candidates.append(candidate_id)
+
+        if len(candidates) == 1:
+            author_id = candidates[0]
+            candidate_last_tokens, candidate_first_names = self.names[author_id]
+            self.names[author_id] = (max(candidate_last_tokens, tuple(last_name.split()), key=len),
+                                     _merge_first_names(candidate_first_names, first_names))
+            self.num_merged += 1
+            log.debug("Author '%s' resolved into: %s" % (author, author_id))
+        else:
+            if len(candidates) > 1:
+                log.debug("Author '%s' is ambiguous between: %s" % (author, ', '.join(candidates)))
+                self.num_ambiguous += 1
+            author_id = last_name + u'|' + u' '.join(first_names)
+            self.names[author_id] = (tuple(last_name.split()), first_names)
+            # other mentions are not resolved into ambiguous authors
+            if block is not None and not candidates:
+                block.append(author_id)
+
+        self.ids[author.key] = author_id
+        return author_id
+
+    def report(self):
+        """
+        Log the number of resolved authors and merged mentions.
+        """
+        if self.num_mentions > 0:
+            log.info("Resolved %s author mentions into %s authors (%s name variants merged, %s ambiguous)." %
+                     (self.num_mentions, len(self.names), self.num_merged, self.num_ambiguous))
+
+    def __len__(self):
+        return len(self.names)
+
+
+def _get_block_key(last_name, first_names):
+    """
+    Get the block of an author: the phonetic code of the last token of its last name and its first initial.
+    :param last_name: normalized last name
+    :param first_names: normalized first name tokens
+    :return: block key (e.g., ('s410', 'r'))
+    """
+    return soundex(last_name.split()[-1]), first_names[0][0] if first_names else u''
+
+
+def _first_names_match(a, b):
+    """
+    Check whether first names match: their tokens are pairwise equal or initials of each other, and missing trailing
+    tokens (e.g., 'Rafael' and 'R. F.') are ignored.
+    :param a: first name tokens
+    :param b: first name tokens
+    :return: whether first names match
+    """
+    for x, y in zip(a, b):
+        if x != y and not (len(x) == 1 and y.startswith(x)) and not (len(y) == 1 and x.startswith(y)):
+            return False
+    return True
+
+
+def _last_names_match(a, b):
+    """
+    Check whether last names match: one is a suffix of the other (e.g., 'da silva' and 'silva'), or is similar to the
+    suffix of the other (e.g., 'da silva' and 'sylva').
+    :param a: last name tokens
+    :param b: last name tokens
+    :return: whether last names match
+    """
+    n = min(len(a), len(b))
+    if a[-n:] == b[-n:]:
+        return True
+    a, b = u' '.join(a[-n:]), u' '.join(b[-n:])
+    # upper bound of the similarity ratio, which avoids comparing names of very different lengths
+    if 2.0 * min(len(a), len(b)) / (len(a) + len(b)) < NAME_SIMILARITY_THRESHOLD:
+        return False
+    return utils.is_similar(a, b, threshold=NAME_SIMILARITY_THRESHOLD)
+
+
+def _merge_first_names(a, b):
+    """
+    Merge matching first names, keeping the complete tokens rather than initials.
+    :param a: first name tokens
+    :param b: first name tokens
+    :return: merged first name tokens
+    """
+    merged = tuple(max(x, y, key=len) for x, y in zip(a, b))
+    return merged + (a[len(merged):] if len(a) > len(b) else b[len(merged):])
+
+
+def soundex(name):
+    """
+    Get the Soundex phonetic code of a name. Names not starting with a latin letter are returned as they are.
+    :param name: normalized name
+    :return: phonetic code (e.g., 'silva' and 'sylva' -> 's410')
+    """
+    if not name or name[0] not in _SOUNDEX_CODES:
+        return name
+    code = name[0]
+    last = _SOUNDEX_CODES[name[0]]
+    for c in name[1:]:
+        digit = _SOUNDEX_CODES.get(c)
+        if digit is None:
+            continue
+        if digit != u'0' and digit != last:
+            code += digit
+            if len(code) == 4:
+                break
+        # 'h' and 'w' do not separate letters with the same code
+        if c not in u'hw':
+            last = digit
+    return (code + u'000')[:4]
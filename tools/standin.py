@@ -0,0 +1,359 @@
+#
+# Copyright 2016 Rafael Ferreira da Silva
+# http://www.rafaelsilva.com/tools
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+__author__ = "Rafael Ferreira da Silva"
+
+import BaseHTTPServer
+import logging
+import random
+import SocketServer
+import threading
+import time
+import urlparse
+import zlib
+
+from datetime import date
+from optparse import OptionParser
+from tools import ratelimit
+from tools import utils
+
+log = logging.getLogger(__name__)
+
+# maximum number of authors listed in an author search page
+AUTHORS_PAGE_SIZE = 10
+
+_TITLE_WORDS = ('scalable', 'workflow', 'scheduling', 'distributed', 'analysis', 'cloud', 'data', 'performance',
+                'resource', 'provenance', 'simulation', 'efficient', 'management', 'scientific', 'computing',
+                'energy', 'model', 'execution', 'adaptive', 'parallel', 'characterization', 'framework', 'grid',
+                'storage', 'failure', 'prediction', 'monitoring', 'network', 'heterogeneous', 'systems')
+_FIRST_NAMES = ('Ana', 'Bruno', 'Carla', 'Daniel', 'Elena', 'Felipe', 'Grace', 'Hiro', 'Ines', 'Jun', 'Karen',
+                'Luis', 'Maria', 'Nikos', 'Olga', 'Pedro', 'Qing', 'Rafael', 'Sara', 'Tomas', 'Uma', 'Victor',
+                'Wei', 'Xin', 'Yara', 'Zoe')
+_LAST_NAMES = ('Almeida', 'Brown', 'Chen', 'Deelman', 'Evans', 'Ferreira', 'Garcia', 'Huang', 'Ito', 'Jones',
+               'Kim', 'Lopez', 'Martin', 'Nguyen', 'Ortiz', 'Patel', 'Quinn', 'Rossi', 'Silva', 'Tanaka',
+               'Ueda', 'Villa', 'Wang', 'Xu', 'Yamada', 'Zhang')
+_VENUES = ('Future Generation Computer Systems', 'Journal of Grid Computing', 'Concurrency and Computation',
+           'IEEE Transactions on Parallel and Distributed Systems', 'Journal of Parallel and Distributed Computing')
+
+_SETTINGS_PAGE = ('<html><body><form id="gs_settings_form" action="/scholar_setprefs">'
+                  '<input type="hidden" name="scisig" value="AAGBfm0AAAAAstandin"></form></body></html>')
+_SETPREFS_PAGE = '<html><body>Your settings have been saved.</body></html>'
+_ERROR_PAGE = '<html><body>Server Error</body></html>'
+_THROTTLED_PAGE = '<html><body>Our systems have detected unusual traffic from your computer network.</body></html>'
+_NOT_FOUND_PAGE = '<html><body>Not Found</body></html>'
+
+
+class StandInServer(object):
+    def __init__(self, num_citations=100, latency=0.0, error_rate=0.0, throttle_rate=None, profile_rate=0.5,
+                 num_authors=2000, seed=0, host='127.0.0.1', port=0):
+        """
+        Create a local stand-in of Google Scholar, which serves synthetic (but deterministic) settings, search,
+        citations, BibTeX export, and author search pages in the formats expected by the parsers. Any title searched
+        is found as a publication with num_citations citations, and each citation has its own citations.
+        :param num_citations: number of citations of the publications found by searches
+        :param latency: number of seconds waited before responding to each request
+        :param error_rate: fraction of requests answered with a server error (HTTP 500)
+        :param throttle_rate: maximum number of requests per second served, above which requests are answered with
+                              an 'unusual traffic' error (HTTP 503), as Google Scholar does (by default, no limit)
+        :param profile_rate: fraction of the authors having a Google Scholar profile
+        :param num_authors: number of distinct authors of the synthetic articles
+        :param seed: seed of the synthetic data
+        :param host: server host
+        :param port: server port (by default, any free port)
+        """
+        self.num_citations = num_citations
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle = ratelimit.TokenBucket(throttle_rate, burst=max(1, int(throttle_rate))) \
+            if throttle_rate else None
+        self.profile_rate = profile_rate
+        self.num_authors = num_authors
+        self.seed = seed
+        self.stats = {}
+        self._titles = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = _ThreadingHTTPServer((host, port), _StandInRequestHandler)
+        self._server.standin = self
+        self._thread = None
+
+    @property
+    def url(self):
+        """
+        Base URL of the server.
+        """
+        return 'http://%s:%s' % self._server.server_address
+
+    def start(self):
+        """
+        Start serving requests in a background thread.
+        :return: base URL of the server
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        log.debug("Google Scholar stand-in listening on: %s" % self.url)
+        return self.url
+
+    def stop(self):
+        """
+        Stop serving requests.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve_forever(self):
+        """
+        Serve requests until interrupted.
+        """
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def get_stats(self):
+        """
+        Get the number of requests served by kind of page ('settings', 'search', 'citations', 'bib', 'authors', and
+        'other'), failed requests ('errors' and 'throttled'), 'connections', and 'bytes' sent.
+        :return: dictionary of counters
+        """
+        with self._lock:
+            return dict(self.stats)
+
+    def reset_stats(self):
+        """
+        Reset the counters of requests.
+        """
+        with self._lock:
+            self.stats = {}
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.stats[name] = self.stats.get(name, 0) + value
+
+    def handle(self, path):
+        """
+        Create the response to a request.
+        :param path: request path (with the query)
+        :return: (HTTP status, page) tuple
+        """
+        url = urlparse.urlsplit(path)
+        args = dict((k, v[-1]) for k, v in urlparse.parse_qs(url.query, keep_blank_values=True).iteritems())
+
+        if url.path == '/scholar_settings':
+            kind, page = 'settings', lambda: _SETTINGS_PAGE
+        elif url.path == '/scholar_setprefs':
+            kind, page = 'settings', lambda: _SETPREFS_PAGE
+        elif url.path == '/scholar' and 'cites' in args:
+            kind, page = 'citations', lambda: self._citations_page(args)
+        elif url.path == '/scholar':
+            kind, page = 'search', lambda: self._search_page(args)
+        elif url.path == '/scholar.bib':
+            kind, page = 'bib', lambda: self._bib_page(args)
+        elif url.path == '/citations' and args.get('view_op') == 'search_authors':
+            kind, page = 'authors', lambda: self._authors_page(args)
+        else:
+            self.count('other')
+            return 404, _NOT_FOUND_PAGE
+        self.count(kind)
+
+        if self.throttle and not self.throttle.try_acquire():
+            self.count('throttled')
+            return 503, _THROTTLED_PAGE
+        if self.error_rate > 0:
+            with self._lock:
+                failed = self._random.random() < self.error_rate
+            if failed:
+                self.count('errors')
+                return 500, _ERROR_PAGE
+        try:
+            return 200, page()
+        except (KeyError, ValueError, IndexError):
+            self.count('errors')
+            return 500, _ERROR_PAGE
+
+    def _search_page(self, args):
+        title = ' '.join(args.get(k, '') for k in ('as_q', 'as_epq', 'q')).strip()
+        if not title:
+            return _results_page(0, [])
+        article_id = zlib.crc32(title) & 0x7fffffff
+        with self._lock:
+            self._titles[article_id] = title
+        return _results_page(1, [self._result(article_id)])
+
+    def _citations_page(self, args):
+        article_id = int(args['cites'])
+        num_citations = self._get_num_citations(article_id)
+        start = int(args.get('start', 0))
+        num = int(args.get('num', 10))
+        # citations are added in index order, thus the newest citations are the last ones
+        indexes = range(num_citations)
+        if args.get('scisbd'):
+            indexes.reverse()
+        results = [self._result(_get_citation_id(article_id, i)) for i in indexes[start:start + num]]
+        return _results_page(num_citations, results)
+
+    def _bib_page(self, args):
+        # e.g., q=info:KEY:scholar.google.com/
+        article_id = int(args['q'].split(':')[1], 16)
+        title, authors, year, venue = self._get_article(article_id)
+        words = title.split()
+        key = "%s%s%s" % (authors[0].split(',')[0].lower(), year, words[0].lower())
+        return ("@article{%s,\n  title={%s},\n  author={%s},\n  journal={%s},\n  year={%s},\n"
+                "  publisher={Elsevier}\n}\n" % (key, title, ' and '.join(authors), venue, year))
+
+    def _authors_page(self, args):
+        # e.g., mauthors="Rafael Silva"|"Ewa Deelman"
+        names = [n.strip().strip('"').replace('+', ' ') for n in args.get('mauthors', '').split('|')]
+        blocks = []
+        for name in names:
+            if not name or len(blocks) >= AUTHORS_PAGE_SIZE:
+                continue
+            author_id = zlib.crc32(name.lower()) & 0x7fffffff
+            if (author_id % 1000) >= self.profile_rate * 1000:
+                continue
+            rnd = random.Random(self.seed ^ author_id)
+            blocks.append('<div class="gsc_1usr gs_scl"><div class="gsc_1usr_photo"><img src="/citations/images/'
+                          'avatar_scholar_56.png"></div><div class="gsc_1usr_text"><h3 class="gsc_1usr_name">'
+                          '<a href="/citations?user=u%x&amp;hl=en">%s</a></h3><div class="gsc_1usr_aff">'
+                          'University of %s</div><div class="gsc_1usr_emlb">Verified email at u%x.edu</div>'
+                          '<div class="gsc_1usr_cby">Cited by %s</div><div class="gsc_1usr_int">'
+                          '<a class="gsc_co_int" href="#">%s</a><a class="gsc_co_int" href="#">%s</a></div>'
+                          '</div></div>' % (author_id, name, rnd.choice(_LAST_NAMES), author_id,
+                                            rnd.randint(1, 20000), rnd.choice(_TITLE_WORDS).title(),
+                                            rnd.choice(_TITLE_WORDS).title()))
+        return ('<html><head><title>Author search</title></head><body><div id="gsc_ccl">%s</div></body></html>' %
+                ''.join(blocks))
+
+    def _result(self, article_id):
+        title, authors, year, venue = self._get_article(article_id)
+        num_citations = self._get_num_citations(article_id)
+        cited_by = '<a href="/scholar?cites=%s&amp;as_sdt=2005&amp;sciodt=0,5&amp;hl=en">Cited by %s</a>' % \
+                   (article_id, num_citations) if num_citations > 0 else ''
+        return ('<div class="gs_r gs_or gs_scl"><div class="gs_ri"><h3 class="gs_rt"><a href="http://example.org/'
+                'p/%s">%s</a></h3><div class="gs_a">%s - %s, %s - example.org</div><div class="gs_rs">Synthetic '
+                'abstract of the article %s.</div><div class="gs_fl">%s<a href="/scholar?q=related:%x:scholar.google'
+                '.com/&amp;hl=en">Related articles</a><a href="/scholar?cluster=%s&amp;hl=en">All 2 versions</a>'
+                '<a href="/scholar.bib?q=info:%x:scholar.google.com/&amp;output=citation&amp;hl=en">Import into '
+                'BibTeX</a></div></div></div>' % (article_id, title, ', '.join(authors), venue, year, article_id,
+                                                    cited_by, article_id, article_id, article_id))
+
+    def _get_article(self, article_id):
+        """
+        Get the synthetic data of an article.
+        :param article_id: article (cluster) ID
+        :return: (title, list of authors, year, venue) tuple
+        """
+        rnd = random.Random(self.seed ^ article_id)
+        with self._lock:
+            title = self._titles.get(article_id)
+        if title is None:
+            title = ' '.join(rnd.choice(_TITLE_WORDS) for _ in range(rnd.randint(4, 9))).capitalize()
+        # author popularity is skewed, thus some authors cite the publications many times
+        authors = []
+        for _ in range(rnd.randint(1, 5)):
+            authors.append(_get_author_name(int(self.num_authors * rnd.random() ** 2)))
+        year = rnd.randint(2000, date.today().year)
+        return title, authors, year, rnd.choice(_VENUES)
+
+    def _get_num_citations(self, article_id):
+        with self._lock:
+            if article_id in self._titles:
+                return self.num_citations
+        return random.Random(self.seed ^ article_id).randint(0, 40) // 4
+
+
+def _get_author_name(index):
+    """
+    Get the name of a synthetic author (e.g., 'Silva, Rafael B.').
+    :param index: author index
+    :return: author name
+    """
+    num_names = len(_FIRST_NAMES) * len(_LAST_NAMES)
+    return "%s, %s %s." % (_LAST_NAMES[index % len(_LAST_NAMES)], _FIRST_NAMES[(index // len(_LAST_NAMES)) %
+                           len(_FIRST_NAMES)], chr(ord('A') + (index // num_names) % 26))
+
+
+def _get_citation_id(article_id, index):
+    return (article_id * 1000003 + index + 1) & 0x7fffffffffff
+
+
+def _results_page(num_results, results):
+    return ('<html><head><title>Google Scholar</title></head><body><div id="gs_ab_md">About {:,} results (0.02 sec)'
+            '</div><div id="gs_res_ccl">{}</div></body></html>'.format(num_results, ''.join(results)))
+
+
+class _StandInRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # keep-alive connections, and responses are written at once (avoiding delays of small writes)
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.standin.count('connections')
+
+    def do_GET(self):
+        standin = self.server.standin
+        if standin.latency > 0:
+            time.sleep(standin.latency)
+        status, page = standin.handle(self.path)
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=UTF-8')
+        self.send_header('Content-Length', str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+        standin.count('bytes', len(page))
+
+    def log_message(self, fmt, *args):
+        log.debug("%s - %s" % (self.address_string(), fmt % args))
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def main():
+    parser = OptionParser(usage="usage: python -m tools.standin [OPTIONS]",
+                          description="Local stand-in of Google Scholar serving synthetic pages. Requests are sent "
+                                      "to the stand-in with the '--scholar-site' option of citationxpert.")
+    parser.add_option("--port", dest="port", action="store", type="int", default=8000,
+                      help="Server port (default: 8000)")
+    parser.add_option("--citations", dest="num_citations", action="store", type="int", default=100,
+                      help="Number of citations of the publications found by searches (default: 100)")
+    parser.add_option("--latency", dest="latency", action="store", type="float", default=0.0,
+                      help="Number of seconds waited before responding to each request (default: 0)")
+    parser.add_option("--error-rate", dest="error_rate", action="store", type="float", default=0.0,
+                      help="Fraction of requests answered with a server error (default: 0)")
+    parser.add_option("--throttle", dest="throttle_rate", action="store", type="float", default=None,
+                      help="Maximum number of requests per second served before throttling (default: no limit)")
+    parser.add_option("-d", "--debug", dest="debug", action="store_true", default=False,
+                      help="Log every request")
+    options, args = parser.parse_args()
+
+    utils.configure_logging(level=logging.DEBUG if options.debug else logging.INFO)
+    standin = StandInServer(num_citations=options.num_citations, latency=options.latency,
+                            error_rate=options.error_rate, throttle_rate=options.throttle_rate,
+                            host='127.0.0.1', port=options.port)
+    log.info("Google Scholar stand-in listening on: %s" % standin.url)
+    try:
+        standin.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    log.info("Served requests: %s" % standin.get_stats())
+
+
+if __name__ == '__main__':
+    main()
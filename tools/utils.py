@@ -17,14 +17,18 @@
 #
 __author__ = "Rafael Ferreira da Silva"
 
+import functools
 import imp
+import itertools
 import logging
 import sys
+import threading
 from difflib import SequenceMatcher
 
 log = logging.getLogger(__name__)
 
 SIMILARITY_THRESHOLD = 0.9
+OUTPUT_BUFFER_SIZE = 1 << 20
 
 
 class ConsoleHandler(logging.StreamHandler):
@@ -84,6 +88,55 @@ def write_output(value, output=None):
         print value
 
 
+class OutputWriter(object):
+    """
+    Buffered writer of output values to a file (defined by output) or standard output stream. Values are written in
+    batches of about buffer_size bytes, in the same format as write_output().
+    """
+
+    def __init__(self, output=None, buffer_size=OUTPUT_BUFFER_SIZE):
+        """
+        :param output: output file object
+        :param buffer_size: number of bytes buffered before writing
+        """
+        self.output = output
+        self.buffer_size = buffer_size
+        self._parts = []
+        self._size = 0
+        # print appends a new line to each value
+        self._separator = '' if output else '\n'
+
+    def write(self, value):
+        """
+        Write an output value.
+        :param value: value object to be written
+        """
+        value = str(value)
+        self._parts.append(value)
+        if self._separator:
+            self._parts.append(self._separator)
+        self._size += len(value) + 1
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all buffered values.
+        """
+        if self._parts:
+            output = self.output or sys.stdout
+            output.write(''.join(self._parts))
+            output.flush()
+            self._parts = []
+            self._size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+
 def check_module(module_name):
     """
     Verify if a module exists
@@ -124,3 +177,37 @@ def is_similar(a, b, threshold=SIMILARITY_THRESHOLD):
         log.debug("String similarity of '%s' detected between: '%s' AND '%s'" % (ratio, a, b))
         return True
     return False
+
+
+def lru_cache(maxsize=100000):
+    """
+    Decorator that memoizes a function of hashable positional arguments. Once maxsize results are stored, the least
+    recently used half of them is discarded (evicting in batches keeps cache hits cheap). The cache is thread-safe.
+    :param maxsize: maximum number of memoized results
+    :return: decorator
+    """
+    def decorator(func):
+        cache = {}
+        clock = itertools.count()
+        lock = threading.Lock()
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            item = cache.get(args)
+            if item is not None:
+                item[1] = next(clock)
+                return item[0]
+
+            value = func(*args)
+            with lock:
+                if len(cache) >= maxsize:
+                    items = sorted(cache.iteritems(), key=lambda i: i[1][1])
+                    for key, _ in items[:max(1, len(items) // 2)]:
+                        del cache[key]
+                cache[args] = [value, next(clock)]
+            return value
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorator